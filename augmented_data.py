@@ -2,27 +2,64 @@ import concurrent.futures
 import datetime
 import json
 import logging
+import multiprocessing
 import os
 import re
-import urllib.request
-from collections import defaultdict
+import sys
+import threading
 from zipfile import ZipFile
 
+import numpy as np
 import pandas as pd
 import requests
+from pandas.api.types import union_categoricals
+
+import http_client
+import instrumentation
+from data_update import (DELTA_EXT, STORE_EXT, get_cache_files_version, is_cache_file_valid, is_full_rebuild_pending, read_antenna_data,
+                         read_pending_delta, record_cache_file)
 
 # Définition des constantes
-CSV_FILENAME = 'SUP_ANTENNE.csv'
+# Membre de l'archive ZIP lu directement, et table compacte des antennes par station qui en est dérivée
+ZIP_MEMBER_NAME = 'SUP_ANTENNE.txt'
+STATION_TABLE_FILENAME = 'SUP_ANTENNE.npz'
 JSON_DIR = 'local_antenna_data'
-AUGMENTED_JSON_DIR = 'local_antenna_data_augmented'
+AUGMENTED_DATA_DIR = 'local_antenna_data_augmented'
 JSON_EXT = '.json'
+# Fichiers augmentés : une ligne par antenne (AER_ID) de chaque station, au format NumPy
+AUGMENTED_EXT = '.npy'
+AUGMENTED_DTYPE = np.dtype([
+    ('station_id', np.int64),
+    ('sta_nm_anfr', 'U24'),
+    ('aer_id', np.int32),
+    ('azimuth', np.float32),
+    ('altitude', np.float32),
+])
 BASE_URL = 'https://www.data.gouv.fr/api/1/'
 PATH = 'datasets/551d4ff3c751df55da0cd89f'
-
-# Configuration des logs
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+# Colonnes lues dans SUP_ANTENNE.txt et types compacts imposés à la lecture
+CSV_USECOLS = ['STA_NM_ANFR', 'AER_ID', 'AER_NB_AZIMUT', 'AER_NB_ALT_BAS']
+CSV_DTYPES = {'STA_NM_ANFR': 'category', 'AER_ID': np.int32, 'AER_NB_AZIMUT': np.float32, 'AER_NB_ALT_BAS': np.float32}
+# Nombre de lignes lues à la fois dans SUP_ANTENNE.txt
+CSV_CHUNK_SIZE = 500_000
+# Copies locales des ressources data.gouv.fr, revalidées par requêtes conditionnelles
+DATASET_CACHE_FILE = os.path.join(http_client.HTTP_CACHE_DIR, 'data_gouv_dataset.json')
+ZIP_CACHE_FILE = os.path.join(http_client.HTTP_CACHE_DIR, 'SUP_ANTENNE.zip')
+# L'augmentation des fichiers est répartie sur des processus (un par cœur au plus) plutôt que sur des threads
+AUGMENT_USE_PROCESSES = True
+
+# Journal partagé ; sa configuration est faite par les points d'entrée (interface, cli.py, server.py)
 logger = logging.getLogger()
 
+# Index en mémoire des azimuts : nom de fichier -> (mtime, {id de station: [azimuts]})
+_azimuth_index = {}
+_azimuth_index_lock = threading.Lock()
+# Index vide partagé, renvoyé tant qu'un fichier augmenté manque : il n'est jamais modifié
+_empty_azimuth_index = {}
+
+# Table des antennes par station chargée une seule fois par processus de travail
+_worker_station_table = None
+
 # Fonction pour créer un répertoire s'il n'existe pas déjà
 def create_directory(dirname: str):
     if not os.path.exists(dirname):
@@ -31,66 +68,29 @@ def create_directory(dirname: str):
     else:
         logger.info(f"Répertoire '{dirname}' existe déjà.")
 
-# Fonction pour supprimer le fichier ZIP après extraction
-def delete_zip_file(zip_path):
-    try:
-        # Suppression du fichier ZIP
-        os.remove(zip_path)
-        # Retour de succès si la suppression s'est bien passée
-        return True
-    except Exception as e:
-        # En cas d'erreur, affichage d'un message d'erreur et retour de l'échec
-        logging.error("Erreur lors de la suppression du fichier ZIP : ", e)
-        return False
-
-# Fonction pour supprimer un fichier CSV local
-def delete_csv_file(file_name):
-    try:
-        # Suppression du fichier
-        os.remove(file_name)
-        # Retour de succès si la suppression s'est bien passée
-        return True
-    except Exception as e:
-        # En cas d'erreur, affichage d'un message d'erreur et retour de l'échec
-        logging.error("Erreur lors de la suppression du fichier local : ", e)
-        return False
-
-# Fonction pour renommer un fichier .txt en .csv
-def rename_txt_file_to_csv_file(old_name, new_name):
-    try:
-        # Renommage du fichier
-        os.rename(old_name, new_name)
-        # Retour de succès si le renommage s'est bien passé
-        return True
-    except Exception as e:
-        # En cas d'erreur, affichage d'un message d'erreur et retour de l'échec
-        logging.error("Erreur lors du renommage du fichier : ", e)
-        return False
-
 # Fonction pour vérifier si le fichier local est à jour par rapport à la version en ligne
 def is_local_file_up_to_date(online_date):
     logger.info("Vérification si le fichier local est à jour...")
     # Vérification de l'existence du fichier local
-    if os.path.exists(CSV_FILENAME):
+    if os.path.exists(STATION_TABLE_FILENAME):
         # Récupération de la date de dernière modification du fichier local
-        local_file_time = os.path.getmtime(CSV_FILENAME)
+        local_file_time = os.path.getmtime(STATION_TABLE_FILENAME)
         local_date = datetime.datetime.fromtimestamp(local_file_time)
         # Si la date du fichier local est plus récente que la date en ligne
         if local_date > online_date:
-            logging.info("La version locale de SUP_ANTENNE.csv est à jour.")
+            logging.info(f"La version locale de {STATION_TABLE_FILENAME} est à jour.")
             # Le fichier local est à jour, pas besoin de télécharger le fichier en ligne
             return False
         else:
-            logging.info("Mise à jour de SUP_ANTENNE.csv...")
-            # Suppression du fichier local avant de télécharger la version en ligne
-            delete_csv_file(CSV_FILENAME)
+            # Le fichier local est conservé jusqu'à ce que sa remplaçante soit entièrement écrite
+            logging.info(f"Mise à jour de {STATION_TABLE_FILENAME}...")
             return True
     else:
         # Si le fichier local n'existe pas, il faut télécharger le fichier en ligne
         return True
 
-# Fonction pour vérifier si un fichier JSON est obsolète par rapport à un fichier CSV
-def is_json_outdated_compared_to_csv(filename, csv_filename):
+# Fonction pour vérifier si un fichier est obsolète par rapport à un fichier de référence
+def is_file_outdated_compared_to(filename, reference_filename):
     # Si le fichier n'existe pas, il est considéré comme obsolète
     if not os.path.exists(filename):
         return True
@@ -98,31 +98,34 @@ def is_json_outdated_compared_to_csv(filename, csv_filename):
     file_time = os.path.getmtime(filename)
     # Convertir le timestamp en date
     file_date = datetime.datetime.fromtimestamp(file_time)
-    # Obtenir le timestamp du fichier CSV
-    csv_file_time = os.path.getmtime(csv_filename)
-    # Convertir le timestamp du fichier CSV en date
-    csv_file_date = datetime.datetime.fromtimestamp(csv_file_time)
-    # Le fichier est obsolète si sa date est antérieure à celle du fichier CSV
-    return file_date < csv_file_date
+    # Obtenir le timestamp du fichier de référence
+    reference_file_time = os.path.getmtime(reference_filename)
+    # Convertir le timestamp du fichier de référence en date
+    reference_file_date = datetime.datetime.fromtimestamp(reference_file_time)
+    # Le fichier est obsolète si sa date est antérieure à celle du fichier de référence
+    return file_date < reference_file_date
 
 # Fonction pour récupérer les données JSON depuis l'API de data.gouv.fr
+@instrumentation.timed("fetch_orientation_dataset")
 def get_data():
     logger.info(f"Envoi de la requête GET à {BASE_URL + PATH}...")
 
-    # Essai d'envoi de la requête GET
-    with requests.get(BASE_URL + PATH) as response:
-        # Si le statut de la réponse n'est pas 200 (succès), log une erreur et retourne None
-        if response.status_code != 200:
-            logger.error(f'Requête GET a échoué avec le statut: {response.status_code}')
-            return None
-        # Essai de décodage du JSON de la réponse
-        try:
-            data = response.json()
-            logger.info('Données JSON reçues avec succès.')
-            return data
-        except json.JSONDecodeError:
-            logger.error("Erreur lors du décodage du JSON.")
-            return None
+    # Essai d'envoi de la requête GET conditionnelle : une réponse 304 réutilise la copie locale
+    try:
+        http_client.fetch_cached(BASE_URL + PATH, DATASET_CACHE_FILE)
+    except requests.exceptions.RequestException as e:
+        # Si la requête a échoué (statut d'erreur ou problème réseau), log une erreur et retourne None
+        logger.error(f'Requête GET a échoué : {e}')
+        return None
+    # Essai de décodage du JSON de la réponse
+    try:
+        with open(DATASET_CACHE_FILE, 'r') as f:
+            data = json.load(f)
+        logger.info('Données JSON reçues avec succès.')
+        return data
+    except json.JSONDecodeError:
+        logger.error("Erreur lors du décodage du JSON.")
+        return None
 
 # Fonction pour trouver l'URL des données à partir de la réponse de l'API
 def find_data_url(data):
@@ -155,11 +158,12 @@ def get_timestamp_from_url(url):
     # Si aucune date n'est trouvée, retour de None
     return None
 
+@instrumentation.timed("orientation_freshness_check")
 def get_antenna_data_last_modified_date():
     logger.info("Obtention de la date de dernière mise à jour des orientations des antennes...")
-    url = BASE_URL + PATH
-    response = requests.get(url)
-    data = response.json()
+    data = get_data()
+    if data is None:
+        return None
     data_url = find_data_url(data)
     if data_url is not None:
         last_modified_date = get_timestamp_from_url(data_url)
@@ -176,9 +180,10 @@ def get_antenna_data_last_modified_date():
 def download_zip_file(file_url):
     logger.info(f"Téléchargement du fichier ZIP depuis {file_url}...")
     try:
-        # Téléchargement du fichier
-        zip_path, _ = urllib.request.urlretrieve(file_url)
-        logger.info(f'Fichier téléchargé avec succès à l\'emplacement: {zip_path}')
+        # Téléchargement conditionnel du fichier : le ZIP en cache est réutilisé s'il n'a pas changé
+        zip_path = ZIP_CACHE_FILE
+        http_client.fetch_cached(file_url, zip_path)
+        logger.info(f'Fichier disponible à l\'emplacement: {zip_path}')
         # Retour du chemin du fichier téléchargé
         return zip_path
     except Exception as e:
@@ -186,25 +191,10 @@ def download_zip_file(file_url):
         logger.error(f"Erreur lors du téléchargement du fichier ZIP : {e}")
         return None
 
-# Fonction pour extraire le fichier CSV du ZIP
-def extract_csv_from_zip(zip_path, file_name):
-    logger.info(f"Extraction de {file_name} du fichier ZIP...")
-    try:
-        # Ouverture du fichier ZIP
-        with ZipFile(zip_path, 'r') as zip_ref:
-            # Extraction du fichier CSV
-            zip_ref.extract(file_name, '.')
-        logger.info(f'Fichier {file_name} extrait avec succès.')
-        # Retour de succès si l'extraction s'est bien passée
-        return True
-    except Exception as e:
-        # En cas d'erreur, affichage d'un message d'erreur et retour de l'échec
-        logger.error(f"Erreur lors de l'extraction du fichier ZIP : {e}")
-        return False
-
-# Fonction pour mettre à jour le fichier CSV
+# Fonction pour mettre à jour la table des antennes par station
+@instrumentation.timed("update_station_table")
 def update_csv_file(data):
-    logger.info("Mise à jour du fichier SUP_ANTENNE.csv...")
+    logger.info(f"Mise à jour de {STATION_TABLE_FILENAME}...")
 
     # Trouver l'URL du fichier de données dans la réponse de l'API
     file_url = find_data_url(data)
@@ -214,128 +204,349 @@ def update_csv_file(data):
     if is_local_file_up_to_date(online_date):
         # Télécharger le fichier ZIP à l'URL trouvée
         zip_path = download_zip_file(file_url)
-        # Si le téléchargement a réussi et que l'extraction du fichier ZIP et le renommage du fichier ont réussi
-        if zip_path is not None and extract_csv_from_zip(zip_path, 'SUP_ANTENNE.txt') and rename_txt_file_to_csv_file('SUP_ANTENNE.txt', CSV_FILENAME):
-            # Supprimer le fichier ZIP téléchargé
-            delete_zip_file(zip_path)
-            logger.info("Mise à jour du fichier SUP_ANTENNE.csv réussie.")
+        # Si le téléchargement a réussi et que la table a été construite à partir de l'archive
+        if zip_path is not None and build_station_table_from_zip(zip_path, ZIP_MEMBER_NAME):
+            # Le fichier ZIP est conservé dans le cache HTTP pour les prochaines revalidations
+            logger.info(f"Mise à jour de {STATION_TABLE_FILENAME} réussie.")
         else:
             logger.error("Erreur lors de la mise à jour.")
 
-# Fonction pour charger un DataFrame à partir d'un fichier CSV
-def load_dataframe_from_csv(filename: str) -> pd.DataFrame:
-    logger.info(f"Chargement du DataFrame à partir de {filename}...")
-
-    # Vérification de l'existence du fichier
-    if not os.path.isfile(filename):
-        logger.error(f"Le fichier '{filename}' n'existe pas.")
-        exit()
-
-    # Liste des colonnes à utiliser dans le DataFrame
-    usecols = ['STA_NM_ANFR', 'AER_ID', 'AER_NB_AZIMUT', 'AER_NB_ALT_BAS']
-
-    # Chargement du fichier CSV dans un DataFrame
-    df = pd.read_csv(filename, delimiter=';', usecols=usecols)
-    
-    # Retour du DataFrame
-    return df
-
-# Fonction pour fusionner les enregistrements du DataFrame dans le fichier JSON
-def merge_dataframe_records_into_json(record: dict, dict_df: defaultdict) -> list:
-    new_data = []
-    # Vérifie si les clés 'fields' et 'sta_nm_anfr' existent dans l'enregistrement
-    if 'fields' in record and 'sta_nm_anfr' in record['fields']:
-        sta_nm_anfr = record['fields']['sta_nm_anfr']
-
-        # Si 'sta_nm_anfr' est dans le dictionnaire DataFrame
-        if sta_nm_anfr in dict_df:
-            # Pour chaque information dans le groupe 'sta_nm_anfr' du dictionnaire DataFrame
-            for info in dict_df[sta_nm_anfr]:
-                # Crée une copie de l'enregistrement
-                new_record = record.copy()
-                # Ajoute de nouvelles données à 'fields' dans l'enregistrement
-                new_record['fields']['aer_id'] = info['AER_ID']
-                new_record['fields']['aer_nb_azimut'] = info['AER_NB_AZIMUT']
-                new_record['fields']['aer_nb_alt_bas'] = info['AER_NB_ALT_BAS']
-                # Ajoute le nouvel enregistrement à la liste des nouvelles données
-                new_data.append(new_record)
-    return new_data
-
-# Fonction pour fusionner les données du fichier JSON avec celles du DataFrame
-def merge_json_with_dataframe(filename: str, dict_df: defaultdict):
-    logger.info(f"Début de l'augmentation du fichier {filename}...")
-    # Essai d'ouvrir et de charger le fichier JSON
+# Fonction pour construire la table des antennes par station en lisant le CSV directement dans l'archive ZIP
+def build_station_table_from_zip(zip_path, member_name):
+    logger.info(f"Lecture de {member_name} dans le fichier ZIP...")
     try:
-        with open(filename, 'r') as f:
-            data = json.load(f)
-    except json.JSONDecodeError:
-        logger.error(f"Erreur : le fichier {filename} n'est pas un JSON valide.")
-        return
-
-    # Liste pour stocker les nouvelles données
-    new_data = []
-    # Pour chaque enregistrement dans les données
-    for record in data:
-        # Fusionne les enregistrements du DataFrame dans l'enregistrement JSON et ajoute les nouveaux enregistrements à la liste des nouvelles données
-        new_data.extend(merge_dataframe_records_into_json(record, dict_df))
+        # Le membre est décompressé en flux et analysé par blocs, sans extraction sur le disque
+        with ZipFile(zip_path, 'r') as zip_ref, zip_ref.open(member_name) as member:
+            df = read_csv_in_chunks(member)
+        instrumentation.count("records_parsed", len(df))
+        table = create_station_antenna_table(df)
+        save_station_antenna_table(STATION_TABLE_FILENAME, table)
+        return True
+    except Exception as e:
+        # En cas d'erreur, la table existante n'est pas modifiée
+        logger.error(f"Erreur lors de la lecture du fichier ZIP : {e}")
+        return False
 
-    # Retourne les nouvelles données
-    return new_data
+# Fonction pour enregistrer la table des antennes par station de manière atomique
+def save_station_antenna_table(filename: str, table):
+    tmp_filename = f"{filename}.tmp"
+    try:
+        with open(tmp_filename, 'wb') as f:
+            np.savez(f, stations=np.asarray(table.stations, dtype=str), offsets=table.offsets,
+                     aer_ids=table.aer_ids, azimuths=table.azimuths, altitudes=table.altitudes)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+# Fonction pour charger la table des antennes par station
+def load_station_antenna_table(filename: str):
+    logger.info(f"Chargement de la table des antennes par station à partir de {filename}...")
+    with np.load(filename) as archive:
+        return StationAntennaTable(archive['stations'], archive['offsets'], archive['aer_ids'],
+                                   archive['azimuths'], archive['altitudes'])
+
+# Fonction pour lire SUP_ANTENNE par blocs et assembler un DataFrame compact
+def read_csv_in_chunks(source) -> pd.DataFrame:
+    # La virgule décimale française est convertie une seule fois, à la lecture
+    reader = pd.read_csv(source, delimiter=';', usecols=CSV_USECOLS, dtype=CSV_DTYPES, decimal=',', chunksize=CSV_CHUNK_SIZE)
+    chunks = list(reader)
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in CSV_DTYPES.items()})
+
+    # Chaque bloc a ses propres catégories de stations : elles sont unifiées sans repasser par des chaînes
+    return pd.DataFrame({
+        'STA_NM_ANFR': union_categoricals([chunk['STA_NM_ANFR'] for chunk in chunks]),
+        'AER_ID': np.concatenate([chunk['AER_ID'].values for chunk in chunks]),
+        'AER_NB_AZIMUT': np.concatenate([chunk['AER_NB_AZIMUT'].values for chunk in chunks]),
+        'AER_NB_ALT_BAS': np.concatenate([chunk['AER_NB_ALT_BAS'].values for chunk in chunks]),
+    })
+
+# Table des antennes par station, stockée dans des tableaux NumPy : les antennes d'une station
+# occupent une tranche contiguë [offsets[i], offsets[i + 1]) des tableaux aer_ids, azimuths et altitudes
+class StationAntennaTable:
+    def __init__(self, stations, offsets, aer_ids, azimuths, altitudes):
+        self.stations = pd.Index(stations)
+        self.offsets = offsets
+        self.aer_ids = aer_ids
+        self.azimuths = azimuths
+        self.altitudes = altitudes
+
+    def __len__(self):
+        return len(self.stations)
+
+# Fonction pour construire la table des antennes par station à partir du DataFrame
+def create_station_antenna_table(df: pd.DataFrame) -> StationAntennaTable:
+    logger.info("Construction de la table des antennes par station...")
+
+    # Tri stable par code de station : les antennes d'une même station deviennent contiguës
+    station_codes = df['STA_NM_ANFR'].cat.codes.values
+    known = station_codes >= 0
+    order = np.argsort(station_codes[known], kind='stable')
+    sorted_codes = station_codes[known][order]
+    counts = np.bincount(sorted_codes, minlength=len(df['STA_NM_ANFR'].cat.categories))
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    return StationAntennaTable(
+        df['STA_NM_ANFR'].cat.categories,
+        offsets,
+        df['AER_ID'].values[known][order],
+        df['AER_NB_AZIMUT'].values[known][order],
+        df['AER_NB_ALT_BAS'].values[known][order],
+    )
+
+# Fonction pour joindre les stations d'un magasin colonnaire aux antennes de la table, sur sta_nm_anfr
+def join_stations_with_antennas(store, dict_df: StationAntennaTable) -> np.ndarray:
+    # Position de chaque station dans la table des antennes (-1 si elle n'y figure pas)
+    positions = dict_df.stations.get_indexer(store['sta_nm_anfr'])
+    rows = np.flatnonzero(positions >= 0)
+    starts = dict_df.offsets[positions[rows]]
+    counts = dict_df.offsets[positions[rows] + 1] - starts
+
+    # Chaque station est répétée autant de fois qu'elle a d'antennes, chacune recevant la sienne
+    station_rows = np.repeat(rows, counts)
+    output_starts = np.cumsum(counts) - counts
+    antenna_rows = np.arange(len(station_rows)) + np.repeat(starts - output_starts, counts)
+
+    augmented = np.empty(len(station_rows), dtype=AUGMENTED_DTYPE)
+    augmented['station_id'] = store['station_id'][station_rows]
+    augmented['sta_nm_anfr'] = store['sta_nm_anfr'][station_rows]
+    augmented['aer_id'] = dict_df.aer_ids[antenna_rows]
+    augmented['azimuth'] = dict_df.azimuths[antenna_rows]
+    augmented['altitude'] = dict_df.altitudes[antenna_rows]
+    return augmented
+
+# Fonction pour lire (en mémoire projetée) le magasin colonnaire de l'ANFR d'un nom de fichier
+def read_store_for_file(filename: str):
+    operator, generation = filename[:-len(STORE_EXT)].rsplit('_', 1)
+    return read_antenna_data(operator, generation, JSON_DIR)
+
+# Fonction pour obtenir le chemin du fichier augmenté associé à un magasin colonnaire
+def get_augmented_filepath(filename: str) -> str:
+    return os.path.join(AUGMENTED_DATA_DIR, filename[:-len(STORE_EXT)] + AUGMENTED_EXT)
+
+# Fonction pour obtenir la version des orientations : empreinte et date des données de chaque fichier augmenté.
+# Une nouvelle table des antennes n'est prise en compte qu'une fois les fichiers augmentés reconstruits, seuls lus par les calculs
+def get_augmented_data_version(operators, generations):
+    filenames = [os.path.basename(get_augmented_filepath(f"{operator}_{generation}{STORE_EXT}"))
+                 for operator in operators for generation in generations]
+    return get_cache_files_version(AUGMENTED_DATA_DIR, filenames)
+
+# Fonction pour vérifier si un fichier augmenté doit être entièrement reconstruit
+def is_augmented_file_outdated(filename: str) -> bool:
+    # Un fichier absent du manifeste ou d'un autre schéma est reconstruit, comme un fichier plus ancien que la table
+    if not is_cache_file_valid(AUGMENTED_DATA_DIR, os.path.basename(get_augmented_filepath(filename)), AUGMENTED_DTYPE):
+        return True
+    # De même si le magasin a été remplacé sans ancienne version à comparer
+    if is_full_rebuild_pending(get_delta_filepath(filename)):
+        return True
+    return is_file_outdated_compared_to(get_augmented_filepath(filename), STATION_TABLE_FILENAME)
 
-# Fonction pour fusionner un fichier JSON avec un DataFrame et sauvegarder le résultat
+# Fonction pour fusionner un magasin colonnaire avec la table des antennes et sauvegarder le résultat
+@instrumentation.timed("augment_file")
 def merge_json_with_dataframe_and_save(filename, dict_df):
-    # Nom complet du fichier JSON original
-    old_file = os.path.join(JSON_DIR, filename)
-    # Nom complet du nouveau fichier JSON
-    new_file = os.path.join(AUGMENTED_JSON_DIR, filename)
-
-    # Si le nouveau fichier JSON est obsolète par rapport au fichier CSV
-    if is_json_outdated_compared_to_csv(new_file, CSV_FILENAME):
-        # Fusionne le fichier JSON avec le DataFrame
-        new_data = merge_json_with_dataframe(old_file, dict_df)
-        # Écrit les nouvelles données dans le nouveau fichier JSON
-        write_list_to_json_file(new_file, new_data)
+    # Nom complet du fichier augmenté
+    new_file = get_augmented_filepath(filename)
+
+    # Si le fichier augmenté est obsolète par rapport à la table des antennes
+    if is_augmented_file_outdated(filename):
+        store = read_store_for_file(filename)
+        if store is None:
+            return False
+        logger.info(f"Début de l'augmentation du fichier {filename}...")
+        # Jointure des stations du magasin avec la table des antennes
+        augmented = join_stations_with_antennas(store, dict_df)
+        write_augmented_file(new_file, augmented)
+        # L'ancien fichier augmenté au format JSON n'est plus utilisé
+        legacy_file = os.path.join(AUGMENTED_DATA_DIR, filename[:-len(STORE_EXT)] + JSON_EXT)
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
+        # L'index des azimuts de ce fichier n'est plus valable
+        invalidate_azimuth_index(filename)
+        # La fusion complète couvre aussi les stations modifiées en attente
+        delete_pending_delta(filename)
+        return True
+    # Sinon, si des stations ont changé depuis la dernière augmentation, seules celles-ci sont traitées
+    elif has_pending_delta(filename):
+        return apply_pending_delta(filename, dict_df)
     else:
         logger.info(f"Le fichier '{new_file}' est à jour.")
+        return False
+
+# Fonction pour enregistrer un fichier augmenté de manière atomique
+def write_augmented_file(filename: str, augmented: np.ndarray):
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, 'wb') as f:
+        np.save(f, augmented)
+    os.replace(tmp_filename, filename)
+
+# Fonction d'initialisation d'un processus de travail : la table est lue depuis le disque plutôt que transmise à chaque tâche
+def init_augmentation_worker(table_filename: str):
+    global _worker_station_table
+    # Les processus de travail journalisent sur la sortie d'erreur : app.log reste au seul processus parent
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(levelname)s: %(message)s')
+    _worker_station_table = load_station_antenna_table(table_filename)
 
-# Fonction pour écrire une liste de données dans un fichier JSON
-def write_list_to_json_file(filename: str, data: list):
-    with open(filename, 'w') as f:
-        json.dump(data, f)
+# Fonction exécutée dans un processus de travail pour augmenter un magasin colonnaire
+def merge_json_file_in_worker(filename: str):
+    return merge_json_with_dataframe_and_save(filename, _worker_station_table)
 
 # Fonction pour traiter les fichiers JSON
-def process_json_files():
-    logger.info("Traitement des fichiers JSON...")
+@instrumentation.timed("process_json_files")
+def process_json_files(use_processes: bool = AUGMENT_USE_PROCESSES):
+    logger.info("Traitement des données de l'ANFR...")
 
-    # Si le répertoire des fichiers JSON n'existe pas, log une erreur et retourne
+    # Si le répertoire des données de l'ANFR n'existe pas, log une erreur et retourne
     if not os.path.exists(JSON_DIR):
         logger.error(f"Erreur : le répertoire '{JSON_DIR}' n'existe pas.")
         return
-    # Liste des fichiers JSON dans le répertoire
-    json_files = [filename for filename in os.listdir(JSON_DIR) if filename.endswith(JSON_EXT)]
-    # Vérifie si les fichiers JSON sont obsolètes par rapport au fichier CSV
-    json_files_are_outdated = any([is_json_outdated_compared_to_csv(os.path.join(AUGMENTED_JSON_DIR, filename), CSV_FILENAME) for filename in json_files])
-    # Si au moins un fichier JSON est obsolète
-    if json_files_are_outdated:
-        # Charge le DataFrame à partir du fichier CSV
-        df = load_dataframe_from_csv(CSV_FILENAME)
-        # Convertit le DataFrame en un dictionnaire
-        dict_df = convert_dataframe_to_dict(df)
-        # Utilise un ThreadPoolExecutor pour fusionner chaque fichier JSON avec le DataFrame et sauvegarder le résultat en parallèle
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            jobs = [executor.submit(merge_json_with_dataframe_and_save, filename, dict_df) for filename in json_files]
-            # Attends que tous les travaux soient terminés
-            for job in concurrent.futures.as_completed(jobs):
-                pass
+    # Liste des magasins colonnaires dans le répertoire
+    json_files = [filename for filename in os.listdir(JSON_DIR) if filename.endswith(STORE_EXT)]
+    # Si la table des antennes par station n'existe pas, log une erreur et retourne
+    if not os.path.exists(STATION_TABLE_FILENAME):
+        logger.error(f"Erreur : le fichier '{STATION_TABLE_FILENAME}' n'existe pas.")
+        return
+    # Seuls les fichiers obsolètes par rapport à la table des antennes ou dont des stations ont changé sont traités
+    json_files = [filename for filename in json_files if is_augmented_file_outdated(filename) or has_pending_delta(filename)]
+    if json_files:
+        if use_processes:
+            # Un processus par fichier à traiter et par cœur au plus : chacun charge la table une fois, seuls les noms de fichiers
+            # sont transmis. Les processus ne sont pas créés par fork : le processus parent peut avoir des threads
+            # (serveur de requêtes) qui détiennent des verrous au moment de la copie
+            max_workers = min(len(json_files), os.cpu_count() or 1)
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=get_augmentation_context(),
+                                                              initializer=init_augmentation_worker,
+                                                              initargs=(STATION_TABLE_FILENAME,))
+            with executor:
+                jobs = {executor.submit(merge_json_file_in_worker, filename): filename for filename in json_files}
+                written_files = wait_for_augmentation_jobs(jobs)
+            # Les index des azimuts de ce processus ne voient pas les mises à jour faites par les autres processus
+            invalidate_azimuth_index()
+        else:
+            # Charge la table des antennes par station construite lors de la mise à jour
+            dict_df = load_station_antenna_table(STATION_TABLE_FILENAME)
+            # Utilise un ThreadPoolExecutor pour fusionner chaque fichier JSON avec la table et sauvegarder le résultat en parallèle
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                jobs = {executor.submit(instrumentation.bind(merge_json_with_dataframe_and_save), filename, dict_df): filename for filename in json_files}
+                written_files = wait_for_augmentation_jobs(jobs)
+        # Le manifeste est mis à jour par ce seul processus, une fois tous les fichiers écrits
+        record_augmented_files(written_files)
     else:
         # Si tous les fichiers JSON sont à jour, log cette information
         logger.info("Tous les fichiers JSON sont à jour.")
 
-# Fonction pour convertir un DataFrame en un dictionnaire
-def convert_dataframe_to_dict(df: pd.DataFrame) -> defaultdict:
-    logger.info("Conversion du DataFrame en dictionnaire...")
-
-    # Groupement du DataFrame par 'STA_NM_ANFR' et conversion des enregistrements dans chaque groupe en une liste de dictionnaires
-    df_grouped = df.groupby('STA_NM_ANFR')[['AER_ID', 'AER_NB_AZIMUT', 'AER_NB_ALT_BAS']].apply(lambda x: x.to_dict('records')).to_dict()
-    return df_grouped
+# Fonction pour choisir le mode de création des processus d'augmentation : forkserver si disponible, sinon spawn
+def get_augmentation_context():
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(start_method)
 
+# Fonction pour attendre la fin des travaux d'augmentation, journaliser leurs erreurs et lister les fichiers réécrits
+def wait_for_augmentation_jobs(jobs: dict) -> list:
+    written_files = []
+    for job in concurrent.futures.as_completed(jobs):
+        try:
+            if job.result():
+                written_files.append(jobs[job])
+        except Exception as e:
+            # Un fichier en échec garde sa version précédente, les autres fichiers sont tout de même traités
+            logger.error(f"Erreur lors de l'augmentation du fichier {jobs[job]} : {e}")
+    return written_files
+
+# Fonction pour enregistrer les fichiers augmentés réécrits dans le manifeste, avec la date de la table des antennes
+def record_augmented_files(written_files: list):
+    data_date = datetime.datetime.fromtimestamp(os.path.getmtime(STATION_TABLE_FILENAME)).strftime("%d-%m-%Y %H:%M:%S")
+    for filename in written_files:
+        filepath = get_augmented_filepath(filename)
+        record_cache_file(AUGMENTED_DATA_DIR, os.path.basename(filepath), np.load(filepath, mmap_mode='r'), data_date)
+
+# Fonction pour obtenir le chemin du fichier des stations modifiées associé à un magasin colonnaire
+def get_delta_filepath(filename):
+    return os.path.join(JSON_DIR, filename[:-len(STORE_EXT)] + DELTA_EXT)
+
+# Fonction pour vérifier si des stations modifiées attendent d'être augmentées
+def has_pending_delta(filename):
+    return os.path.exists(get_delta_filepath(filename))
+
+# Fonction pour supprimer le fichier des stations modifiées une fois traité
+def delete_pending_delta(filename):
+    delta_file = get_delta_filepath(filename)
+    if os.path.exists(delta_file):
+        os.remove(delta_file)
+
+# Fonction pour mettre à jour un fichier augmenté pour les seules stations modifiées
+def apply_pending_delta(filename, dict_df):
+    new_file = get_augmented_filepath(filename)
+    affected_ids = read_pending_delta(get_delta_filepath(filename))
+    logger.info(f"Mise à jour de {len(affected_ids)} stations dans le fichier {new_file}...")
+    affected_ids_array = np.fromiter(affected_ids, dtype=np.int64, count=len(affected_ids))
+
+    # Les lignes des stations modifiées ou supprimées sont retirées du fichier augmenté
+    augmented = np.load(new_file)
+    augmented = augmented[~np.isin(augmented['station_id'], affected_ids_array)]
+
+    # Les nouvelles versions des stations ajoutées ou modifiées sont jointes à la table puis ajoutées
+    store = read_store_for_file(filename)
+    if store is None:
+        return False
+    new_rows = join_stations_with_antennas(store[np.isin(store['station_id'], affected_ids_array)], dict_df)
+
+    write_augmented_file(new_file, np.concatenate([augmented, new_rows]))
+    # Seules les entrées des stations touchées sont mises à jour dans l'index des azimuts
+    update_azimuth_index(filename, affected_ids, new_rows)
+    delete_pending_delta(filename)
+    return True
+
+# Fonction pour construire l'index des azimuts à partir des lignes d'un fichier augmenté
+def build_azimuth_index(augmented: np.ndarray) -> dict:
+    # Une station possède plusieurs antennes (aer_id), on conserve tous leurs azimuts
+    augmented = augmented[~np.isnan(augmented['azimuth'])]
+    order = np.argsort(augmented['station_id'], kind='stable')
+    station_ids = augmented['station_id'][order]
+    azimuths = augmented['azimuth'][order].astype(np.float64)
+    unique_ids, starts = np.unique(station_ids, return_index=True)
+    return dict(zip(unique_ids.tolist(), (group.tolist() for group in np.split(azimuths, starts[1:]))))
+
+# Fonction pour obtenir l'index des azimuts d'un opérateur et d'une génération
+def get_azimuth_index(operator: str, generation: str) -> dict:
+    filename = f"{operator}_{generation}{STORE_EXT}"
+    filepath = get_augmented_filepath(filename)
+    try:
+        mtime = os.stat(filepath).st_mtime_ns
+    except FileNotFoundError:
+        return _empty_azimuth_index
+
+    # Le fichier n'est lu qu'une fois tant qu'il n'a pas été réécrit
+    with _azimuth_index_lock:
+        entry = _azimuth_index.get(filename)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+    # Un fichier augmenté absent du manifeste ou d'un autre schéma n'est pas lu
+    if not is_cache_file_valid(AUGMENTED_DATA_DIR, os.path.basename(filepath), AUGMENTED_DTYPE):
+        return _empty_azimuth_index
+
+    logger.info(f"Construction de l'index des azimuts pour {filepath}...")
+    index = build_azimuth_index(np.load(filepath, mmap_mode='r'))
+    with _azimuth_index_lock:
+        _azimuth_index[filename] = (mtime, index)
+    return index
+
+# Fonction pour mettre à jour l'index des azimuts d'un fichier pour quelques stations seulement
+def update_azimuth_index(filename: str, affected_ids: set, new_rows: np.ndarray):
+    filepath = get_augmented_filepath(filename)
+    with _azimuth_index_lock:
+        entry = _azimuth_index.get(filename)
+        if entry is None:
+            return
+        # Copie de l'index pour ne pas modifier celui en cours d'utilisation par une requête
+        index = {antenna_id: azimuths for antenna_id, azimuths in entry[1].items() if antenna_id not in affected_ids}
+        index.update(build_azimuth_index(new_rows))
+        _azimuth_index[filename] = (os.stat(filepath).st_mtime_ns, index)
+
+# Fonction pour invalider l'index des azimuts d'un fichier (ou de tous les fichiers)
+def invalidate_azimuth_index(filename: str = None):
+    with _azimuth_index_lock:
+        if filename is None:
+            _azimuth_index.clear()
+        else:
+            _azimuth_index.pop(filename, None)
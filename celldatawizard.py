@@ -1,11 +1,14 @@
-import json
+import copy
+import hashlib
+import itertools
 import logging
 import math
 import os
+import weakref
 from datetime import datetime
-from threading import Thread
+from threading import Lock, RLock, Thread
 
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import folium
 
 
@@ -14,11 +17,24 @@ import pandas as pd
 import requests
 from geopy.distance import distance
 from requests.exceptions import RequestException
-from shapely.geometry import Point
-import tkinter as tk
-from tkinter import ttk
+import shapely
+
+# Tkinter n'est nécessaire que pour l'interface graphique : le module reste importable sans affichage
+try:
+    import tkinter as tk
+    from tkinter import ttk
+except ImportError:
+    tk = None
+    ttk = None
 
 import augmented_data
+import data_update
+import http_client
+import instrumentation
+from density_grid import DensityGrid
+from polygon_index import PolygonIndex, load_geojson_polygons
+from result_cache import ResultCache
+from spatial_index import GridIndex
 from augmented_data import get_antenna_data_last_modified_date
 from data_update import (download_antenna_data, get_anfr_data_last_modified_date, 
                          read_antenna_data, retrieve_or_update_antenna_data)
@@ -43,21 +59,110 @@ OPERATOR_NAME_MAPPING = {
     "SFR CARAIBES": "OUTREMER TELECOM",
 }
 
+ORIENTATION_HALF_ANGLE = 70  # 140° de vision, donc 70° de chaque côté de l'azimut
+
+DOWNLOAD_MAX_WORKERS = http_client.HTTP_POOL_SIZE  # Nombre maximal de téléchargements ANFR simultanés, une connexion du pool chacun
+
+RESULT_CACHE_MAX_ENTRIES = 1024  # Nombre de résultats gardés en mémoire par le cache LRU
+RESULT_CACHE_DISK_PATH = None  # Fichier SQLite du niveau disque du cache de résultats (désactivé par défaut)
+
+APPROXIMATE_MIN_RADIUS = 20  # Rayon (km) en dessous duquel le mode approché utilise le calcul exact
+
+NEAREST_ANTENNA_COUNT = 5  # Nombre d'antennes les plus proches renvoyées par défaut pour chaque opérateur et génération
+
+BATCH_MAX_PAIRS = 2_000_000  # Nombre maximal de paires (point, antenne) évaluées à la fois en mode batch
+
+# Jeu de données d'antennes chargé, conservé tant que les magasins colonnaires ne changent pas
+_antenna_dataset_cache = {"dataset": None}
+# Jeux de données encore utilisés, retrouvés à partir de leur DataFrame (id du DataFrame -> jeu de données)
+_antenna_datasets = weakref.WeakValueDictionary()
+# Dernier jeu de données créé pour un DataFrame fourni directement, hors chargement
+_frame_dataset_cache = {"dataset": None}
+_antenna_cache_lock = Lock()
+# Un seul chargement à la fois : deux appels simultanés ne construisent pas deux fois le même DataFrame
+_antenna_load_lock = Lock()
+_result_cache = ResultCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_DISK_PATH)
+
+
+# Jeu de données d'antennes : le DataFrame et tout ce que les requêtes en dérivent (index spatiaux, codes de groupe,
+# azimuts, grilles), construits une seule fois. Un rechargement crée un nouvel objet : les requêtes encore en cours
+# sur l'ancien gardent ses structures, et les deux jeux de données ne s'évincent pas l'un l'autre
+class AntennaDataset:
+    def __init__(self, df_antennas, version=None):
+        self.df = df_antennas
+        self.version = version
+        self.structures = {}
+        self.lock = RLock()
+
+    # Renvoie une structure dérivée, construite au premier appel
+    def get_structure(self, name, build):
+        with self.lock:
+            if name not in self.structures:
+                self.structures[name] = build(self.df)
+            return self.structures[name]
+
+    def get_spatial_index(self):
+        return self.get_structure("spatial_index", build_spatial_index)
+
+    def get_group_codes(self):
+        return self.get_structure("group_codes", get_group_codes)
+
+    def get_group_spatial_indexes(self):
+        return self.get_structure("group_indexes", lambda df: build_group_spatial_indexes(df, self.get_group_codes()))
+
+    def get_density_grid(self):
+        return self.get_structure("density_grid", lambda df: build_density_grid(df, self.get_group_codes()))
+
+    def get_antenna_points(self):
+        return self.get_structure("antenna_points", lambda df: shapely.points(df["longitude"].values, df["latitude"].values))
+
+    # Table des azimuts, reconstruite si les fichiers augmentés ont été relus depuis (rafraîchissement des orientations)
+    def get_azimuth_table(self):
+        indexes = {(operator, generation): augmented_data.get_azimuth_index(operator, generation)
+                   for operator, generation in self.get_structure("groups", get_antenna_groups)}
+        with self.lock:
+            cached_indexes, table = self.structures.get("azimuth_table", ({}, None))
+        if cached_indexes.keys() == indexes.keys() and all(cached_indexes[key] is index for key, index in indexes.items()):
+            return table
+
+        # La table est construite hors du verrou : les autres structures restent accessibles aux requêtes en cours
+        table = build_azimuth_table(self.df, indexes)
+        with self.lock:
+            self.structures["azimuth_table"] = (indexes, table)
+        return table
+
+    # Construction anticipée de tout ce que les requêtes réutilisent, avant la mise en service du jeu de données
+    def warm(self):
+        self.get_spatial_index()
+        self.get_group_codes()
+        self.get_group_spatial_indexes()
+        self.get_azimuth_table()
+        self.get_density_grid()
+
 def get_geolocation_info():
     try:
-        response = requests.get('http://ip-api.com/json/')
+        response = http_client.get('http://ip-api.com/json/')
         geodata = response.json()
         return geodata
     except requests.exceptions.RequestException as e:
         logging.error("RequestException in get_geolocation_info: %s", e)
         return None
         
-def create_df_from_antenna_data(all_data):
-    df = pd.DataFrame({"record": all_data})
-    df["latitude"] = df["record"].apply(lambda x: x["fields"]["coordonnees"][1])
-    df["longitude"] = df["record"].apply(lambda x: x["fields"]["coordonnees"][0])
-    df["generation"] = df["record"].apply(lambda x: x["fields"]["generation"])
-    df["operator"] = df["record"].apply(lambda x: x["fields"]["adm_lb_nom"])
+def create_df_from_antenna_stores(stores):
+    if not stores:
+        stores = [np.empty(0, dtype=data_update.STORE_DTYPE)]
+
+    # Seules les colonnes utiles aux requêtes sont copiées depuis les magasins projetés en mémoire
+    def concatenate_column(name):
+        return np.concatenate([store[name] for store in stores])
+
+    df = pd.DataFrame({
+        "latitude": concatenate_column("latitude"),
+        "longitude": concatenate_column("longitude"),
+        "station_id": concatenate_column("station_id"),
+        "generation": pd.Categorical.from_codes(concatenate_column("generation_code"), categories=data_update.GENERATIONS),
+        "operator": pd.Categorical.from_codes(concatenate_column("operator_code"), categories=data_update.OPERATORS),
+    })
     return df
 
 def haversine(lat1, lon1, lat2, lon2):
@@ -76,21 +181,74 @@ def haversine(lat1, lon1, lat2, lon2):
     
     return c * r
 
-def add_geometry_and_distance_to_df(df, lat, lon):
-    df["geometry"] = df.apply(lambda x: Point(x["longitude"], x["latitude"]), axis=1)
-    df["distance"] = haversine(lat, lon, df["latitude"].values, df["longitude"].values)   
+def add_geometry_and_distance_to_df(df, lat, lon, with_geometry=False):
+    # La géométrie n'est construite qu'à la demande, en une seule opération vectorisée
+    if with_geometry:
+        df["geometry"] = shapely.points(df["longitude"].values, df["latitude"].values)
+    df["distance"] = haversine(lat, lon, df["latitude"].values, df["longitude"].values)
     return df
 
 def filter_df_within_radius(df, radius):
     df_within_radius = df[df["distance"] <= radius]
     return df_within_radius
 
-def filter_antennas_by_radius(all_data, lat, lon, radius):
-    df = create_df_from_antenna_data(all_data)
-    df = add_geometry_and_distance_to_df(df, lat, lon)
-    df_within_radius = filter_df_within_radius(df, radius)
+def get_antenna_dataset(df_antennas):
+    # Jeu de données d'un DataFrame : celui qui l'a chargé s'il est encore utilisé, sinon un nouveau jeu de données
+    with _antenna_cache_lock:
+        dataset = _antenna_datasets.get(id(df_antennas))
+        if dataset is None or dataset.df is not df_antennas:
+            dataset = AntennaDataset(df_antennas)
+            _antenna_datasets[id(df_antennas)] = dataset
+            _frame_dataset_cache["dataset"] = dataset
+        return dataset
+
+def build_spatial_index(df_antennas):
+    return GridIndex(df_antennas["latitude"].values, df_antennas["longitude"].values)
+
+def get_spatial_index(df_antennas):
+    # L'index est construit à la première requête puis réutilisé pour le même jeu de données
+    return get_antenna_dataset(df_antennas).get_spatial_index()
+
+def filter_antennas_by_radius(df_antennas, lat, lon, radius, with_geometry=False):
+    _, df_within_radius = filter_antenna_rows_by_radius(df_antennas, lat, lon, radius, with_geometry)
     return df_within_radius
 
+def filter_antenna_rows_by_radius(df_antennas, lat, lon, radius, with_geometry=False):
+    # Seules les antennes des cellules de la grille qui recoupent le cercle sont mesurées ;
+    # avec une liste de rayons, le filtrage se fait sur le plus grand.
+    # Renvoie aussi la position des lignes retenues dans df_antennas, quel que soit son index
+    radius = float(np.max(radius))
+    with instrumentation.stage("distances"):
+        candidates = get_spatial_index(df_antennas).query_candidates(lat, lon, radius)
+        df = add_geometry_and_distance_to_df(df_antennas.iloc[candidates].copy(), lat, lon, with_geometry)
+        within = df["distance"].values <= radius
+        df_within_radius = df[within]
+    instrumentation.count("rows_filtered", len(df_within_radius))
+    return candidates[within], df_within_radius
+
+def load_antenna_dataset(operators, generations, local_data_dir, anfr_last_modified_date, update_progress_callback):
+    with instrumentation.stage("retrieve_antenna_data"):
+        all_stores = retrieve_all_antenna_stores(operators, generations, local_data_dir, anfr_last_modified_date, update_progress_callback)
+    if not all_stores:
+        return None
+
+    # Le jeu de données (DataFrame et index) est réutilisé tant que la version des données est la même
+    version = data_update.get_antenna_store_version(operators, generations, local_data_dir)
+    with _antenna_load_lock:
+        dataset = _antenna_dataset_cache["dataset"]
+        if dataset is not None and dataset.version == version:
+            return dataset
+        with instrumentation.stage("build_dataframe"):
+            dataset = AntennaDataset(create_df_from_antenna_stores(all_stores), version)
+        with _antenna_cache_lock:
+            _antenna_datasets[id(dataset.df)] = dataset
+        _antenna_dataset_cache["dataset"] = dataset
+        return dataset
+
+def load_antenna_frame(operators, generations, local_data_dir, anfr_last_modified_date, update_progress_callback):
+    dataset = load_antenna_dataset(operators, generations, local_data_dir, anfr_last_modified_date, update_progress_callback)
+    return None if dataset is None else dataset.df
+
 def create_data_dir_if_not_exists(local_data_dir):
     if not os.path.exists(local_data_dir):
         os.makedirs(local_data_dir)
@@ -98,91 +256,208 @@ def create_data_dir_if_not_exists(local_data_dir):
 def calculate_total_steps(operators, generations):
     return len(operators) * len(generations)
 
-def download_all_antenna_data(operators, generations, local_data_dir, anfr_last_modified_date, update_progress_callback):
+def run_antenna_jobs(job_function, operators, generations, local_data_dir, job_args, update_progress_callback, max_workers=DOWNLOAD_MAX_WORKERS):
     total_steps = calculate_total_steps(operators, generations)
     current_step = 0
-    download_failures = []
+    results = {}
+
+    # Un job par couple (opérateur, génération), avec un nombre borné de threads simultanés.
+    # Les mesures faites dans les threads sont rattachées à la requête en cours
+    job_function = instrumentation.bind(job_function)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        jobs = {executor.submit(job_function, operator, generation, local_data_dir, *job_args): (operator, generation)
+                for operator in operators for generation in generations}
+
+        # La progression avance à chaque job terminé, quel que soit l'ordre de fin
+        for job in as_completed(jobs):
+            operator, generation = jobs[job]
+            try:
+                results[(operator, generation)] = job.result()
+            except Exception as e:
+                logging.error(f"Erreur lors de la récupération des données pour {operator} {generation} : {e}")
+                results[(operator, generation)] = None
 
-    # Créez un gestionnaire de contexte avec ThreadPoolExecutor
-    with ThreadPoolExecutor(max_workers=12) as executor:  # max_workers définit le nombre maximum de threads utilisés simultanément
-        # Créez une liste de tous les jobs à exécuter. Chaque job est une exécution de la fonction download_antenna_data avec des paramètres spécifiques
-        jobs = [executor.submit(download_antenna_data, operator, generation, local_data_dir) for operator in operators for generation in generations]
-        
-        for job in concurrent.futures.as_completed(jobs):
-            success = job.result()  # récupère le résultat de download_antenna_data, qui est un booléen
-            
-            if not success:
-                download_failures.append((operator, generation))  # Vous pouvez également modifier votre fonction download_antenna_data pour qu'elle renvoie le couple (operator, generation) en cas d'échec
-            
             current_step += 1
-            progress = (current_step / total_steps) * 100
-            update_progress_callback(progress)
-    
+            if update_progress_callback is not None:
+                progress = (current_step / total_steps) * 100
+                update_progress_callback(progress)
+
+    return results
+
+def download_all_antenna_data(operators, generations, local_data_dir, anfr_last_modified_date, update_progress_callback):
+    results = run_antenna_jobs(download_antenna_data, operators, generations, local_data_dir, (), update_progress_callback)
+    download_failures = [(operator, generation) for operator in operators for generation in generations
+                         if not results[(operator, generation)]]
     return download_failures
 
-def retrieve_all_antenna_data(operators, generations, local_data_dir, anfr_last_modified_date, update_progress_callback):
-    all_data = []
-    total_steps = calculate_total_steps(operators, generations)
-    current_step = 0
+def retrieve_all_antenna_stores(operators, generations, local_data_dir, anfr_last_modified_date, update_progress_callback):
+    results = run_antenna_jobs(retrieve_or_update_antenna_data, operators, generations, local_data_dir,
+                               (anfr_last_modified_date,), update_progress_callback)
+
+    # Les magasins sont assemblés dans un ordre fixe, indépendant de l'ordre de fin des téléchargements
+    all_stores = []
     for operator in operators:
         for generation in generations:
-            data = retrieve_or_update_antenna_data(operator, generation, local_data_dir, anfr_last_modified_date)
-            if data is not None:
-                all_data.extend(data)
-            current_step += 1
-            progress = (current_step / total_steps) * 100
-            update_progress_callback(progress)
-    return all_data
+            store = results[(operator, generation)]
+            if store is None:
+                logging.error(f"Données indisponibles pour {operator} {generation}.")
+            else:
+                all_stores.append(store)
+    return all_stores
+
+def get_group_codes(df):
+    # Code du groupe (génération, opérateur) de chaque ligne, -1 pour un groupe inconnu
+    generation_codes = pd.Categorical(df["generation"], categories=data_update.GENERATIONS).codes.astype(np.intp)
+    operator_codes = pd.Categorical(df["operator"], categories=data_update.OPERATORS).codes.astype(np.intp)
+    known = (generation_codes >= 0) & (operator_codes >= 0)
+    return np.where(known, generation_codes * len(data_update.OPERATORS) + operator_codes, -1)
+
+def get_group_code(generation, operator):
+    # Code du groupe (génération, opérateur), comme get_group_codes, -1 pour un groupe inconnu
+    if generation not in data_update.GENERATIONS or operator not in data_update.OPERATORS:
+        return -1
+    return data_update.GENERATIONS.index(generation) * len(data_update.OPERATORS) + data_update.OPERATORS.index(operator)
+
+def get_antenna_group_codes(df_antennas):
+    # Codes de groupe du jeu de données complet, calculés une seule fois par jeu de données
+    return get_antenna_dataset(df_antennas).get_group_codes()
+
+def build_density_grid(df_antennas, group_codes):
+    return DensityGrid(df_antennas["latitude"].values, df_antennas["longitude"].values, group_codes,
+                       len(data_update.GENERATIONS) * len(data_update.OPERATORS))
+
+def get_density_grid(df_antennas):
+    # Grilles de comptage et sommes cumulées, construites une seule fois par jeu de données
+    return get_antenna_dataset(df_antennas).get_density_grid()
+
+def build_group_spatial_indexes(df_antennas, group_codes):
+    # Un index spatial par groupe (génération, opérateur), pour que la recherche des plus proches voisins
+    # d'un groupe peu dense ne parcoure pas les antennes des autres groupes
+    latitudes = df_antennas["latitude"].values
+    longitudes = df_antennas["longitude"].values
+    indexes = {}
+    for group_code in np.unique(group_codes[group_codes >= 0]):
+        rows = np.flatnonzero(group_codes == group_code)
+        indexes[int(group_code)] = (rows, GridIndex(latitudes[rows], longitudes[rows]))
+    return indexes
+
+def get_group_spatial_indexes(df_antennas):
+    return get_antenna_dataset(df_antennas).get_group_spatial_indexes()
+
+def get_antenna_points(df_antennas):
+    # Géométries shapely de toutes les antennes, construites une seule fois par jeu de données
+    return get_antenna_dataset(df_antennas).get_antenna_points()
+
+def warm_antenna_caches(df_antennas):
+    # Construction anticipée de tout ce que les requêtes réutilisent : index spatiaux, codes de groupe, azimuts et grilles
+    get_antenna_dataset(df_antennas).warm()
+
+def count_antennas_by_group(df, weights=None):
+    # Comptage en une passe sur les codes catégoriels : matrice génération × opérateur
+    group_codes = get_group_codes(df)
+    known = group_codes >= 0
+    if weights is not None:
+        weights = np.asarray(weights)[known]
+    counts = np.bincount(group_codes[known], weights=weights, minlength=len(data_update.GENERATIONS) * len(data_update.OPERATORS))
+    return counts.reshape(len(data_update.GENERATIONS), len(data_update.OPERATORS))
+
+def get_group_count(counts, generation, operator):
+    if generation not in data_update.GENERATIONS or operator not in data_update.OPERATORS:
+        return 0
+    return int(counts[data_update.GENERATIONS.index(generation), data_update.OPERATORS.index(operator)])
 
 def calculate_antenna_densities(operators, generations, df_within_radius, area):
-    densities = {gen: {} for gen in generations}
-    for generation in generations:
-        for operator in operators:
-            filtered_df = df_within_radius.query("`generation` == @generation and `operator` == @operator")
-            densities[generation][operator] = len(filtered_df) / area
-    return densities
+    antenna_counts = count_antennas(operators, generations, df_within_radius)
+    return densities_from_counts(antenna_counts, area)
+
+def densities_from_counts(antenna_counts, area):
+    return {generation: {operator: count / area for operator, count in counts.items()}
+            for generation, counts in antenna_counts.items()}
 
 def count_antennas(operators, generations, df_within_radius):
+    counts = count_antennas_by_group(df_within_radius)
     antenna_counts = {gen: {} for gen in generations}
     for generation in generations:
         for operator in operators:
-            filtered_df = df_within_radius.query("`generation` == @generation and `operator` == @operator")
-            antenna_counts[generation][operator] = len(filtered_df)
+            antenna_counts[generation][operator] = get_group_count(counts, generation, operator)
     return antenna_counts
 
+def get_antenna_azimuths(antenna_id, operator, generation):
+    return augmented_data.get_azimuth_index(operator, generation).get(antenna_id, [])
+
 def get_antenna_azimuth(antenna_id, operator, generation):
-    filepath = os.path.join(AUGMENTED_DATA_DIR, f"{operator}_{generation}.json")
-    with open(filepath, "r") as file:
-        data = json.load(file)
-    for record in data:
-        if record['fields']['id'] == antenna_id:
-            azimuth = record['fields'].get('aer_nb_azimut', None)
-            if azimuth is not None:
-                azimuth = azimuth.replace(',', '.')  # Remplace la virgule par un point
-                return float(azimuth)  # Convertit en float avant de renvoyer
+    azimuths = get_antenna_azimuths(antenna_id, operator, generation)
+    if azimuths:
+        return azimuths[0]
     return None
 
-def calculate_oriented_antennas(operators, generations, df_within_radius, lat, lon):
+def calculate_oriented_antennas(operators, generations, df_within_radius, rows, lat, lon, azimuth_table):
     oriented_antennas = {gen: {} for gen in generations}
+    selected = (df_within_radius["generation"].isin(generations) & df_within_radius["operator"].isin(operators)).values
+    df = df_within_radius[selected]
+    if df.empty:
+        return oriented_antennas
+
+    # Azimuts lus dans la table à plat du jeu de données complet, aux positions des lignes retenues
+    azimuth_counts, azimuths = gather_azimuths(azimuth_table, rows[selected])
+
+    oriented_rows = flag_oriented_antennas(df["latitude"].values, df["longitude"].values, lat, lon, azimuth_counts, azimuths)
+    counts = count_antennas_by_group(df, weights=oriented_rows)
     for generation in generations:
         for operator in operators:
-            df_operator_gen = df_within_radius.query("`generation` == @generation and `operator` == @operator")
-            for index, row in df_operator_gen.iterrows():
-                azimuth = get_antenna_azimuth(row['record']['fields']['id'], operator, generation)
-                if azimuth is not None:
-                    if is_oriented_towards_point(row['latitude'], row['longitude'], azimuth, lat, lon):
-                        if operator in oriented_antennas[generation]:
-                            oriented_antennas[generation][operator] += 1
-                        else:
-                            oriented_antennas[generation][operator] = 1
+            count = get_group_count(counts, generation, operator)
+            if count:
+                oriented_antennas[generation][operator] = count
     return oriented_antennas
 
+def gather_azimuths(azimuth_table, rows):
+    # Nombre d'azimuts de chaque ligne demandée et leurs azimuts à la suite, sans boucle Python
+    azimuth_offsets, azimuth_counts, azimuths = azimuth_table
+    row_azimuth_counts = azimuth_counts[rows]
+    azimuth_starts = np.repeat(azimuth_offsets[rows], row_azimuth_counts)
+    azimuth_ranks = np.arange(len(azimuth_starts)) - np.repeat(np.cumsum(row_azimuth_counts) - row_azimuth_counts, row_azimuth_counts)
+    return row_azimuth_counts, azimuths[azimuth_starts + azimuth_ranks]
+
+def flatten_azimuth_lists(azimuth_lists):
+    azimuth_counts = np.fromiter((len(azimuths) for azimuths in azimuth_lists), dtype=np.intp, count=len(azimuth_lists))
+    azimuths = np.fromiter(itertools.chain.from_iterable(azimuth_lists), dtype=np.float64, count=int(azimuth_counts.sum()))
+    return azimuth_counts, azimuths
+
+def flag_oriented_antennas(antenna_lats, antenna_lons, point_lats, point_lons, azimuth_counts, azimuths):
+    # Un seul relèvement par station, puis comparaison avec tous ses azimuts
+    pair_rows = np.repeat(np.arange(len(antenna_lats)), azimuth_counts)
+    bearings = calculate_bearings(antenna_lats, antenna_lons, point_lats, point_lons)
+    oriented_pairs = angular_difference(bearings[pair_rows], azimuths) <= ORIENTATION_HALF_ANGLE
+
+    # Une station est orientée vers le point si l'une de ses antennes l'est
+    return np.bincount(pair_rows, weights=oriented_pairs, minlength=len(antenna_lats)) > 0
+
+def get_azimuth_table(df_antennas):
+    # Azimuts de toutes les antennes du jeu de données, à plat dans l'ordre des lignes
+    return get_antenna_dataset(df_antennas).get_azimuth_table()
+
+def get_antenna_groups(df_antennas):
+    groups = df_antennas[["operator", "generation"]].drop_duplicates()
+    return list(zip(groups["operator"], groups["generation"]))
+
+def build_azimuth_table(df_antennas, indexes):
+    azimuth_lists = [indexes[(operator, generation)].get(station_id, [])
+                     for station_id, operator, generation in zip(df_antennas["station_id"], df_antennas["operator"], df_antennas["generation"])]
+    azimuth_counts, azimuths = flatten_azimuth_lists(azimuth_lists)
+    azimuth_offsets = np.concatenate(([0], np.cumsum(azimuth_counts)[:-1])).astype(np.intp)
+    return azimuth_offsets, azimuth_counts, azimuths
+
 def is_oriented_towards_point(antenna_lat, antenna_lon, antenna_azimuth, point_lat, point_lon):
     angle_to_point = calculate_bearing(antenna_lat, antenna_lon, point_lat, point_lon)
-    if abs(angle_to_point - antenna_azimuth) <= 70:  # 140° de vision, donc 70° de chaque côté de l'azimut
+    if angular_difference(angle_to_point, antenna_azimuth) <= ORIENTATION_HALF_ANGLE:
         return True
     return False
 
+def angular_difference(angle1, angle2):
+    # Écart angulaire le plus court, en tenant compte du passage par 0°/360°
+    difference = np.abs(np.asarray(angle1) - np.asarray(angle2)) % 360
+    return np.minimum(difference, 360 - difference)
+
 def calculate_bearing(lat1, lon1, lat2, lon2):
     lat1 = math.radians(lat1)
     lat2 = math.radians(lat2)
@@ -192,32 +467,358 @@ def calculate_bearing(lat1, lon1, lat2, lon2):
     bearing = math.degrees(math.atan2(x, y))
     return (bearing + 360) % 360  # Normalisation à 0-360
 
-def calculate_antenna_density_and_counts(operators, generations, all_data, lat, lon, radius):
+def calculate_bearings(lat1, lon1, lat2, lon2):
+    # Version vectorisée de calculate_bearing
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    diff_long = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    x = np.sin(diff_long) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - (np.sin(lat1) * np.cos(lat2) * np.cos(diff_long))
+    bearings = np.degrees(np.arctan2(x, y))
+    return (bearings + 360) % 360  # Normalisation à 0-360
+
+def calculate_antenna_density_and_counts(operators, generations, df_antennas, lat, lon, radius):
     area = math.pi * radius * radius
-    df_within_radius = filter_antennas_by_radius(all_data, lat, lon, radius)
-    densities = calculate_antenna_densities(operators, generations, df_within_radius, area)
-    antenna_counts = count_antennas(operators, generations, df_within_radius)
-    oriented_antennas = calculate_oriented_antennas(operators, generations, df_within_radius, lat, lon)
+    rows, df_within_radius = filter_antenna_rows_by_radius(df_antennas, lat, lon, radius)
+    with instrumentation.stage("counting"):
+        antenna_counts = count_antennas(operators, generations, df_within_radius)
+        densities = densities_from_counts(antenna_counts, area)
+    with instrumentation.stage("orientation"):
+        oriented_antennas = calculate_oriented_antennas(operators, generations, df_within_radius, rows, lat, lon, get_azimuth_table(df_antennas))
     return densities, antenna_counts, oriented_antennas
 
-def calculate_density(operators, generations, lat, lon, radius, anfr_last_modified_date, update_progress_callback):
+def calculate_antenna_density_and_counts_multi_radius(operators, generations, df_antennas, lat, lon, radii):
+    # Distances et orientations calculées une seule fois pour le plus grand rayon, puis chaque antenne est rangée
+    # dans son anneau par searchsorted : les comptages cumulés s'obtiennent par une somme cumulée sur les anneaux
+    radii = np.unique(np.asarray(radii, dtype=np.float64))
+    n_groups = len(data_update.GENERATIONS) * len(data_update.OPERATORS)
+    rows, df_within_radius = filter_antenna_rows_by_radius(df_antennas, lat, lon, radii)
+
+    group_codes = get_group_codes(df_within_radius)
+    known = group_codes >= 0
+    rings = np.searchsorted(radii, df_within_radius["distance"].values, side="left")
+    ring_keys = rings[known] * n_groups + group_codes[known]
+    ring_counts = np.bincount(ring_keys, minlength=len(radii) * n_groups).reshape(len(radii), n_groups)
+
+    azimuth_counts, azimuths = gather_azimuths(get_azimuth_table(df_antennas), rows)
+    oriented_rows = flag_oriented_antennas(df_within_radius["latitude"].values, df_within_radius["longitude"].values, lat, lon,
+                                           azimuth_counts, azimuths)
+    ring_oriented = np.bincount(ring_keys, weights=oriented_rows[known], minlength=len(radii) * n_groups).reshape(len(radii), n_groups)
+
+    # Disques : sommes cumulées des anneaux ; anneaux : entre deux rayons consécutifs (le premier part du centre)
+    profile = {}
+    for radius, counts, oriented in zip(radii, ring_counts.cumsum(axis=0), ring_oriented.cumsum(axis=0)):
+        profile[float(radius)] = format_group_counts(operators, generations, counts, oriented, math.pi * radius * radius)
+    ring_profile = {}
+    inner_radii = np.concatenate(([0.0], radii[:-1]))
+    for inner_radius, outer_radius, counts, oriented in zip(inner_radii, radii, ring_counts, ring_oriented):
+        area = math.pi * (outer_radius * outer_radius - inner_radius * inner_radius)
+        ring_profile[(float(inner_radius), float(outer_radius))] = format_group_counts(operators, generations, counts, oriented, area)
+    return profile, ring_profile
+
+def format_group_counts(operators, generations, counts, oriented, area):
+    # Mise en forme d'une matrice de comptage par groupe, comme calculate_antenna_density_and_counts
+    counts = counts.reshape(len(data_update.GENERATIONS), len(data_update.OPERATORS))
+    oriented = oriented.reshape(len(data_update.GENERATIONS), len(data_update.OPERATORS))
+    antenna_counts = {gen: {} for gen in generations}
+    oriented_antennas = {gen: {} for gen in generations}
+    for generation in generations:
+        for operator in operators:
+            antenna_counts[generation][operator] = get_group_count(counts, generation, operator)
+            oriented_count = get_group_count(oriented, generation, operator)
+            if oriented_count:
+                oriented_antennas[generation][operator] = oriented_count
+    return densities_from_counts(antenna_counts, area), antenna_counts, oriented_antennas
+
+def calculate_antenna_density_and_counts_approximate(operators, generations, df_antennas, lat, lon, radius, min_radius=APPROXIMATE_MIN_RADIUS):
+    # Temps constant par les grilles pour les grands rayons, avec un encadrement du nombre exact d'antennes ;
+    # calcul exact pour les petits rayons, près des pôles ou de l'antiméridien
+    area = math.pi * radius * radius
+    grid_result = get_density_grid(df_antennas).query(lat, lon, radius) if radius >= min_radius else None
+    if grid_result is None:
+        antenna_counts = count_antennas(operators, generations, filter_antennas_by_radius(df_antennas, lat, lon, radius))
+        count_bounds = {generation: {operator: (count, count) for operator, count in counts.items()}
+                        for generation, counts in antenna_counts.items()}
+        return densities_from_counts(antenna_counts, area), antenna_counts, count_bounds
+
+    shape = (len(data_update.GENERATIONS), len(data_update.OPERATORS))
+    estimate, lower, upper = (counts.reshape(shape) for counts in grid_result)
+    antenna_counts = {gen: {} for gen in generations}
+    count_bounds = {gen: {} for gen in generations}
+    for generation in generations:
+        for operator in operators:
+            antenna_counts[generation][operator] = get_group_count(estimate, generation, operator)
+            count_bounds[generation][operator] = (get_group_count(lower, generation, operator), get_group_count(upper, generation, operator))
+    return densities_from_counts(antenna_counts, area), antenna_counts, count_bounds
+
+def configure_result_cache(max_entries=RESULT_CACHE_MAX_ENTRIES, disk_path=RESULT_CACHE_DISK_PATH):
+    global _result_cache
+    _result_cache = ResultCache(max_entries, disk_path)
+
+def get_result_cache_stats():
+    return _result_cache.stats()
+
+def get_data_version():
+    # Version des données ANFR (magasins colonnaires) et des orientations (table SUP_ANTENNE et fichiers augmentés)
+    version = (data_update.get_antenna_store_version(OPERATORS, GENERATIONS, LOCAL_DATA_DIR),
+               augmented_data.get_augmented_data_version(OPERATORS, GENERATIONS))
+    return hashlib.blake2b(repr(version).encode("utf-8"), digest_size=8).hexdigest()
+
+def calculate_antenna_density_and_counts_cached(operators, generations, df_antennas, lat, lon, radius):
+    # Tout rafraîchissement de l'un des deux jeux de données change la version et vide le cache
+    result_cache = _result_cache
+    result_cache.set_data_version(get_data_version())
+    key = result_cache.make_key(operators, generations, lat, lon, radius)
+    result = result_cache.get(key)
+    if result is not None:
+        instrumentation.count("result_cache_hits")
+    else:
+        result = calculate_antenna_density_and_counts(operators, generations, df_antennas, lat, lon, radius)
+        result_cache.put(key, result)
+    # Copie pour que l'appelant ne modifie pas le résultat mémorisé
+    densities, antenna_counts, oriented_antennas = copy.deepcopy(result)
+    return densities, antenna_counts, oriented_antennas
+
+def calculate_antenna_density_and_counts_batch(operators, generations, df_antennas, lats, lons, radii, max_pairs=BATCH_MAX_PAIRS):
+    lats, lons, radii = np.broadcast_arrays(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64), np.asarray(radii, dtype=np.float64))
+    lats, lons, radii = lats.ravel(), lons.ravel(), radii.ravel()
+    n_points = len(lats)
+    n_groups = len(data_update.GENERATIONS) * len(data_update.OPERATORS)
+
+    # Données partagées par tous les points : index spatial, codes de groupe et azimuts
+    spatial_index = get_spatial_index(df_antennas)
+    group_codes = get_antenna_group_codes(df_antennas)
+    antenna_lats = df_antennas["latitude"].values
+    antenna_lons = df_antennas["longitude"].values
+    azimuth_table = get_azimuth_table(df_antennas)
+
+    counts = np.zeros((n_points, n_groups), dtype=np.int64)
+    oriented_counts = np.zeros((n_points, n_groups), dtype=np.int64)
+
+    def process_chunk(chunk_points, chunk_candidates):
+        # Paires (point, antenne candidate) du bloc, limitées à max_pairs environ
+        chunk_points = np.asarray(chunk_points)
+        pair_locals = np.repeat(np.arange(len(chunk_points)), [len(candidates) for candidates in chunk_candidates])
+        pair_points = chunk_points[pair_locals]
+        pair_antennas = np.concatenate(chunk_candidates)
+        distances = haversine(lats[pair_points], lons[pair_points], antenna_lats[pair_antennas], antenna_lons[pair_antennas])
+        within = (distances <= radii[pair_points]) & (group_codes[pair_antennas] >= 0)
+        pair_locals = pair_locals[within]
+        pair_points = pair_points[within]
+        pair_antennas = pair_antennas[within]
+        instrumentation.count("rows_filtered", len(pair_antennas))
+        pair_keys = pair_locals * n_groups + group_codes[pair_antennas]
+        counts[chunk_points] = np.bincount(pair_keys, minlength=len(chunk_points) * n_groups).reshape(-1, n_groups)
+
+        # Azimuts des paires retenues, lus dans la table à plat
+        pair_azimuth_counts, pair_azimuths = gather_azimuths(azimuth_table, pair_antennas)
+        oriented = flag_oriented_antennas(antenna_lats[pair_antennas], antenna_lons[pair_antennas], lats[pair_points], lons[pair_points],
+                                          pair_azimuth_counts, pair_azimuths)
+        oriented_counts[chunk_points] = np.bincount(pair_keys, weights=oriented, minlength=len(chunk_points) * n_groups).reshape(-1, n_groups)
+
+    chunk_points = []
+    chunk_candidates = []
+    chunk_pairs = 0
+    for point in range(n_points):
+        candidates = spatial_index.query_candidates(lats[point], lons[point], radii[point])
+        chunk_points.append(point)
+        chunk_candidates.append(candidates)
+        chunk_pairs += len(candidates)
+        if chunk_pairs >= max_pairs:
+            process_chunk(chunk_points, chunk_candidates)
+            chunk_points, chunk_candidates, chunk_pairs = [], [], 0
+    if chunk_points:
+        process_chunk(chunk_points, chunk_candidates)
+
+    # Tableau « tidy » : une ligne par point × génération × opérateur demandés
+    n_selected, group_columns = select_group_columns(operators, generations, counts, oriented_counts, math.pi * radii * radii)
+    result = pd.DataFrame({
+        "point": np.repeat(np.arange(n_points), n_selected),
+        "latitude": np.repeat(lats, n_selected),
+        "longitude": np.repeat(lons, n_selected),
+        "radius": np.repeat(radii, n_selected),
+        **group_columns,
+    })
+    return result
+
+def select_group_columns(operators, generations, counts, oriented_counts, areas):
+    # Colonnes par groupe des tableaux « tidy » (une ligne par entité × génération × opérateur demandés),
+    # à partir des matrices de comptage entité × groupe et de la surface de chaque entité
+    group_pairs = [(generation, operator) for generation in generations for operator in operators]
+    group_codes = np.array([get_group_code(generation, operator) for generation, operator in group_pairs], dtype=np.intp)
+    known = group_codes >= 0
+    selected_counts = np.where(known, counts[:, group_codes], 0)
+    selected_oriented = np.where(known, oriented_counts[:, group_codes], 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        selected_densities = selected_counts / np.asarray(areas)[:, np.newaxis]
+
+    n_entities = len(counts)
+    return len(group_pairs), {
+        "generation": np.tile([generation for generation, _ in group_pairs], n_entities),
+        "operator": np.tile([operator for _, operator in group_pairs], n_entities),
+        "density": selected_densities.ravel(),
+        "count": selected_counts.ravel(),
+        "oriented_count": selected_oriented.ravel(),
+    }
+
+def find_nearest_antennas_batch(operators, generations, df_antennas, lats, lons, k=NEAREST_ANTENNA_COUNT):
+    lats, lons = np.broadcast_arrays(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+    lats, lons = lats.ravel(), lons.ravel()
+    group_indexes = get_group_spatial_indexes(df_antennas)
+    azimuth_offsets, azimuth_counts, azimuths = get_azimuth_table(df_antennas)
+
+    # Recherche indexée des k plus proches antennes de chaque groupe demandé, pour chaque point
+    group_pairs = [(generation, operator) for generation in generations for operator in operators
+                   if get_group_code(generation, operator) >= 0]
+    points, ranks, rows, distances, group_positions = [], [], [], [], []
+    for point in range(len(lats)):
+        for position, (generation, operator) in enumerate(group_pairs):
+            group_code = get_group_code(generation, operator)
+            if group_code not in group_indexes:
+                continue
+            group_rows, group_index = group_indexes[group_code]
+            nearest, nearest_distances = group_index.query_nearest(lats[point], lons[point], k)
+            points.append(np.full(len(nearest), point))
+            ranks.append(np.arange(1, len(nearest) + 1))
+            rows.append(group_rows[nearest])
+            distances.append(nearest_distances)
+            group_positions.append(np.full(len(nearest), position))
+
+    if rows:
+        points, ranks, rows, distances, group_positions = (np.concatenate(values) for values in (points, ranks, rows, distances, group_positions))
+    else:
+        points, ranks, rows, group_positions = (np.empty(0, dtype=np.intp) for _ in range(4))
+        distances = np.empty(0, dtype=np.float64)
+
+    # Relèvement depuis le point, azimuts de la station et orientation vers le point
+    antenna_lats = df_antennas["latitude"].values[rows]
+    antenna_lons = df_antennas["longitude"].values[rows]
+    row_azimuth_counts = azimuth_counts[rows]
+    azimuth_lists = [azimuths[offset:offset + count].tolist() for offset, count in zip(azimuth_offsets[rows], row_azimuth_counts)]
+    _, row_azimuths = flatten_azimuth_lists(azimuth_lists)
+    oriented = flag_oriented_antennas(antenna_lats, antenna_lons, lats[points], lons[points], row_azimuth_counts, row_azimuths)
+
+    result = pd.DataFrame({
+        "point": points,
+        "latitude": lats[points],
+        "longitude": lons[points],
+        "generation": [group_pairs[position][0] for position in group_positions],
+        "operator": [group_pairs[position][1] for position in group_positions],
+        "rank": ranks,
+        "station_id": df_antennas["station_id"].values[rows],
+        "antenna_latitude": antenna_lats,
+        "antenna_longitude": antenna_lons,
+        "distance": distances,
+        "bearing": calculate_bearings(lats[points], lons[points], antenna_lats, antenna_lons),
+        "azimuths": azimuth_lists,
+        "oriented": oriented,
+    })
+    return result
+
+def calculate_antenna_density_and_counts_polygons(operators, generations, df_antennas, polygon_index):
+    n_polygons = len(polygon_index.ids)
+    n_groups = len(data_update.GENERATIONS) * len(data_update.OPERATORS)
+    group_codes = get_antenna_group_codes(df_antennas)
+
+    # Affectation de toutes les antennes à tous les polygones en une seule requête sur l'arbre STRtree
+    pair_antennas, pair_polygons = polygon_index.assign_points(get_antenna_points(df_antennas))
+    known = group_codes[pair_antennas] >= 0
+    pair_antennas, pair_polygons = pair_antennas[known], pair_polygons[known]
+    pair_keys = pair_polygons * n_groups + group_codes[pair_antennas]
+    counts = np.bincount(pair_keys, minlength=n_polygons * n_groups).reshape(n_polygons, n_groups)
+
+    # Orientation des antennes vers un point intérieur de leur polygone, qui remplace le centre du cercle
+    pair_azimuth_counts, pair_azimuths = gather_azimuths(get_azimuth_table(df_antennas), pair_antennas)
+    oriented = flag_oriented_antennas(df_antennas["latitude"].values[pair_antennas], df_antennas["longitude"].values[pair_antennas],
+                                      polygon_index.center_latitudes[pair_polygons], polygon_index.center_longitudes[pair_polygons],
+                                      pair_azimuth_counts, pair_azimuths)
+    oriented_counts = np.bincount(pair_keys, weights=oriented, minlength=n_polygons * n_groups).astype(np.int64).reshape(n_polygons, n_groups)
+
+    # Tableau « tidy » : une ligne par polygone × génération × opérateur demandés
+    n_selected, group_columns = select_group_columns(operators, generations, counts, oriented_counts, polygon_index.areas)
+    result = pd.DataFrame({
+        "polygon": np.repeat(np.arange(n_polygons), n_selected),
+        "polygon_id": np.repeat(np.array(polygon_index.ids, dtype=object), n_selected),
+        "area": np.repeat(polygon_index.areas, n_selected),
+        **group_columns,
+    })
+    return result
+
+def prepare_antenna_dataset(operators, generations, anfr_last_modified_date, update_progress_callback=None, refresh_orientations=True):
     create_data_dir_if_not_exists(LOCAL_DATA_DIR)
     
-    all_data = retrieve_all_antenna_data(operators, generations, LOCAL_DATA_DIR, anfr_last_modified_date, update_progress_callback)
+    dataset = load_antenna_dataset(operators, generations, LOCAL_DATA_DIR, anfr_last_modified_date, update_progress_callback)
 
-    if not all_data:
+    if dataset is None:
         return f"Erreur lors du téléchargement ou de la récupération des données d'antenne."
 
     create_data_dir_if_not_exists(AUGMENTED_DATA_DIR)
 
+    # Sans rafraîchissement, les orientations déjà présentes localement sont utilisées telles quelles
+    if not refresh_orientations:
+        return dataset
+
     data = augmented_data.get_data()
     if data is not None:
         augmented_data.update_csv_file(data)
         augmented_data.process_json_files()
 
-    # Pas besoin de récupérer à nouveau les données
-    densities, antenna_counts, oriented_antennas = calculate_antenna_density_and_counts(operators, generations, all_data, lat, lon, radius)
-    return densities, antenna_counts, oriented_antennas
+    return dataset
+
+def prepare_antenna_data(operators, generations, anfr_last_modified_date, update_progress_callback=None, refresh_orientations=True):
+    dataset = prepare_antenna_dataset(operators, generations, anfr_last_modified_date, update_progress_callback, refresh_orientations)
+    return dataset if isinstance(dataset, str) else dataset.df
+
+def calculate_density(operators, generations, lat, lon, radius, anfr_last_modified_date, update_progress_callback=None, refresh_orientations=True):
+    # Un enregistrement de mesures par appel, si l'instrumentation est activée
+    with instrumentation.request("calculate_density", lat=lat, lon=lon, radius=radius):
+        df_antennas = prepare_antenna_data(operators, generations, anfr_last_modified_date, update_progress_callback, refresh_orientations)
+        if isinstance(df_antennas, str):
+            return df_antennas
+
+        # Pas besoin de récupérer à nouveau les données
+        densities, antenna_counts, oriented_antennas = calculate_antenna_density_and_counts_cached(operators, generations, df_antennas, lat, lon, radius)
+        return densities, antenna_counts, oriented_antennas
+
+def calculate_density_profile(operators, generations, lat, lon, radii, anfr_last_modified_date, update_progress_callback=None, refresh_orientations=True):
+    with instrumentation.request("calculate_density_profile", lat=lat, lon=lon, radii=[float(radius) for radius in np.ravel(radii)]):
+        df_antennas = prepare_antenna_data(operators, generations, anfr_last_modified_date, update_progress_callback, refresh_orientations)
+        if isinstance(df_antennas, str):
+            return df_antennas
+        with instrumentation.stage("profile_kernel"):
+            return calculate_antenna_density_and_counts_multi_radius(operators, generations, df_antennas, lat, lon, radii)
+
+def calculate_density_batch(operators, generations, lats, lons, radii, anfr_last_modified_date, update_progress_callback=None, refresh_orientations=True):
+    # Les données et l'index spatial sont chargés une seule fois pour tous les points
+    with instrumentation.request("calculate_density_batch", points=int(np.size(lats))):
+        df_antennas = prepare_antenna_data(operators, generations, anfr_last_modified_date, update_progress_callback, refresh_orientations)
+        if isinstance(df_antennas, str):
+            return df_antennas
+        with instrumentation.stage("batch_kernel"):
+            return calculate_antenna_density_and_counts_batch(operators, generations, df_antennas, lats, lons, radii)
+
+def find_nearest_antennas(operators, generations, lats, lons, anfr_last_modified_date, k=NEAREST_ANTENNA_COUNT, update_progress_callback=None, refresh_orientations=True):
+    with instrumentation.request("find_nearest_antennas", points=int(np.size(lats)), k=k):
+        df_antennas = prepare_antenna_data(operators, generations, anfr_last_modified_date, update_progress_callback, refresh_orientations)
+        if isinstance(df_antennas, str):
+            return df_antennas
+        with instrumentation.stage("nearest_kernel"):
+            return find_nearest_antennas_batch(operators, generations, df_antennas, lats, lons, k)
+
+def calculate_density_polygons(operators, generations, polygons_path, anfr_last_modified_date, id_property=None, update_progress_callback=None, refresh_orientations=True):
+    with instrumentation.request("calculate_density_polygons", polygons_path=polygons_path):
+        try:
+            with instrumentation.stage("load_polygons"):
+                ids, geometries = load_geojson_polygons(polygons_path, id_property)
+                polygon_index = PolygonIndex(ids, geometries)
+        except (OSError, ValueError, AttributeError) as e:
+            return f"Erreur lors de la lecture des polygones : {e}"
+        instrumentation.count("polygons_loaded", len(ids))
+        df_antennas = prepare_antenna_data(operators, generations, anfr_last_modified_date, update_progress_callback, refresh_orientations)
+        if isinstance(df_antennas, str):
+            return df_antennas
+        with instrumentation.stage("polygon_kernel"):
+            return calculate_antenna_density_and_counts_polygons(operators, generations, df_antennas, polygon_index)
 
 def validate_inputs(lat, lon, radius):
     if not lat or not lon or not radius:
@@ -275,13 +876,13 @@ def create_map(densities, lat, lon, radius):
     # Parcoure les antennes dans le dataframe
     for index, row in df.iterrows():
         # Calcule l'orientation de l'antenne
-        azimuth = get_antenna_azimuth(row['record']['fields']['id'], row['operator'], row['generation'])
+        azimuth = get_antenna_azimuth(row['station_id'], row['operator'], row['generation'])
 
         # Si l'antenne est orientée vers le point d'intérêt, elle est ajoutée sur la carte
         if azimuth is not None and is_oriented_towards_point(row['latitude'], row['longitude'], azimuth, poi_lat, poi_lon):
             folium.Marker(
                 location=[row['latitude'], row['longitude']],
-                popup=f"Antenna ID: {row['record']['fields']['id']}<br>Operator: {row['operator']}<br>Generation: {row['generation']}<br>Azimuth: {azimuth}",
+                popup=f"Antenna ID: {row['station_id']}<br>Operator: {row['operator']}<br>Generation: {row['generation']}<br>Azimuth: {azimuth}",
                 icon=folium.Icon(color="green" if row['operator'] == 'ORANGE' else "blue"),  # change la couleur en fonction de l'opérateur
             ).add_to(m)
 
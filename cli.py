@@ -0,0 +1,182 @@
+import argparse
+import logging
+import sys
+
+import numpy as np
+import pandas as pd
+
+import celldatawizard
+import instrumentation
+from data_update import GENERATIONS, OPERATORS, get_anfr_data_last_modified_date
+
+OUTPUT_FORMATS = ["csv", "json", "parquet"]
+
+DEFAULT_RADIUS = 1.0
+
+# Fonction pour analyser les arguments de la ligne de commande
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Calcul sans interface graphique de la densité d'antennes autour d'un ou plusieurs points.",
+    )
+    parser.add_argument("input", nargs="?", default="-",
+                        help="Fichier CSV des points (colonnes latitude, longitude et éventuellement radius), '-' pour l'entrée standard")
+    parser.add_argument("--lat", type=float, help="Latitude d'un point unique (à la place du fichier d'entrée)")
+    parser.add_argument("--lon", type=float, help="Longitude d'un point unique (à la place du fichier d'entrée)")
+    parser.add_argument("--radius", type=float, default=DEFAULT_RADIUS,
+                        help="Rayon en kilomètres pour les points sans colonne radius")
+    parser.add_argument("--polygons", help="Fichier GeoJSON de zones (communes, IRIS, emprises...) : densités par polygone au lieu de cercles")
+    parser.add_argument("--id-property", help="Propriété GeoJSON servant d'identifiant des polygones (identifiant de l'élément par défaut)")
+    parser.add_argument("--delimiter", default=",", help="Séparateur du fichier CSV d'entrée")
+    parser.add_argument("--operators", nargs="+", choices=OPERATORS, default=OPERATORS, metavar="OPERATOR",
+                        help="Opérateurs à prendre en compte")
+    parser.add_argument("--generations", nargs="+", choices=GENERATIONS, default=GENERATIONS, metavar="GENERATION",
+                        help="Générations à prendre en compte")
+    parser.add_argument("-o", "--output", default="-", help="Fichier de sortie, '-' pour la sortie standard")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS,
+                        help="Format de sortie (déduit de l'extension du fichier de sortie par défaut, sinon csv)")
+    parser.add_argument("--offline", action="store_true",
+                        help="Utilise les données locales sans vérifier leur fraîcheur en ligne")
+    parser.add_argument("--metrics", help="Fichier où écrire les mesures par étape au format texte de Prometheus")
+    parser.add_argument("--trace", help="Fichier où écrire les mesures par étape au format JSON Trace Event (chrome://tracing, Perfetto)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Mesure aussi le pic de mémoire Python de chaque requête (tracemalloc, plus lent)")
+    args = parser.parse_args(argv)
+
+    if (args.lat is None) != (args.lon is None):
+        parser.error("--lat et --lon doivent être renseignés ensemble.")
+    if args.format is None:
+        extension = args.output.rsplit(".", 1)[-1].lower() if "." in args.output else ""
+        args.format = extension if extension in OUTPUT_FORMATS else "csv"
+    if args.format == "parquet" and args.output == "-":
+        parser.error("Le format parquet nécessite un fichier de sortie (--output).")
+    return args
+
+# Fonction pour lire les points à partir d'un fichier CSV ou de l'entrée standard
+def read_points(source, default_radius, delimiter=","):
+    points = pd.read_csv(sys.stdin if source == "-" else source, sep=delimiter)
+    missing_columns = {"latitude", "longitude"} - set(points.columns)
+    if missing_columns:
+        raise ValueError(f"Colonnes manquantes dans le fichier d'entrée : {', '.join(sorted(missing_columns))}")
+    if "radius" not in points.columns:
+        points["radius"] = default_radius
+    points["radius"] = points["radius"].fillna(default_radius)
+    return points
+
+# Fonction pour vérifier les points, avec les mêmes règles que celldatawizard.validate_inputs
+def validate_points(points):
+    try:
+        lats = points["latitude"].astype(float).values
+        lons = points["longitude"].astype(float).values
+        radii = points["radius"].astype(float).values
+    except ValueError:
+        return "Les coordonnées et le rayon doivent être des nombres."
+
+    checks = [
+        ((lats >= -90) & (lats <= 90), "La latitude doit être comprise entre -90 et 90."),
+        ((lons >= -180) & (lons <= 180), "La longitude doit être comprise entre -180 et 180."),
+        ((radii >= 0) & (radii <= 10000), "Le rayon doit être compris entre 0 et 10 000 km."),
+    ]
+    for valid, message in checks:
+        invalid_rows = np.flatnonzero(~valid)
+        if len(invalid_rows):
+            return f"{message} (lignes : {', '.join(str(row) for row in invalid_rows[:10])})"
+    return None
+
+# Fonction pour écrire les résultats dans le format demandé
+def write_results(results, output, output_format):
+    destination = sys.stdout if output == "-" else output
+    if output_format == "csv":
+        results.to_csv(destination, index=False)
+    elif output_format == "json":
+        results.to_json(destination, orient="records", force_ascii=False)
+    elif output_format == "parquet":
+        results.to_parquet(output, index=False)
+
+# Fonction de suivi de la progression dans le journal
+def log_progress(progress):
+    logging.info(f"Progression du chargement des données : {progress:.0f} %")
+
+# Fonction de calcul pour une liste de points, utilisable depuis d'autres programmes
+def run(points, operators=OPERATORS, generations=GENERATIONS, anfr_last_modified_date=None,
+        update_progress_callback=log_progress, refresh_orientations=True):
+    return celldatawizard.calculate_density_batch(
+        operators, generations,
+        points["latitude"].astype(float).values, points["longitude"].astype(float).values, points["radius"].astype(float).values,
+        anfr_last_modified_date, update_progress_callback, refresh_orientations,
+    )
+
+# Fonction de calcul par polygone, à partir d'un fichier GeoJSON
+def run_polygons(args):
+    anfr_last_modified_date = None if args.offline else get_anfr_data_last_modified_date()
+    results = celldatawizard.calculate_density_polygons(args.operators, args.generations, args.polygons, anfr_last_modified_date,
+                                                        args.id_property, log_progress, refresh_orientations=not args.offline)
+    if isinstance(results, str):
+        logging.error(results)
+        return 1
+    return write_or_log_results(results, args)
+
+# Fonction pour écrire les résultats en journalisant les erreurs d'écriture
+def write_or_log_results(results, args):
+    try:
+        write_results(results, args.output, args.format)
+    except (OSError, ImportError) as e:
+        logging.error(f"Erreur lors de l'écriture des résultats : {e}")
+        return 1
+    return 0
+
+# Fonction pour écrire les mesures demandées en fin d'exécution
+def write_instrumentation(args):
+    try:
+        if args.metrics:
+            instrumentation.write_prometheus(args.metrics)
+        if args.trace:
+            instrumentation.write_json_trace(args.trace)
+    except OSError as e:
+        logging.error(f"Erreur lors de l'écriture des mesures : {e}")
+
+def main(argv=None):
+    # Le journal va sur la sortie d'erreur : la sortie standard ne contient que les résultats
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(levelname)s: %(message)s')
+    args = parse_args(argv)
+
+    # Les mesures ne sont activées que si elles sont exportées : sinon, elles ne coûtent rien
+    if args.metrics or args.trace:
+        instrumentation.enable(trace_memory=args.trace_memory)
+    try:
+        return run_command(args)
+    finally:
+        if instrumentation.is_enabled():
+            write_instrumentation(args)
+
+def run_command(args):
+    if args.polygons is not None:
+        return run_polygons(args)
+
+    try:
+        if args.lat is not None:
+            points = pd.DataFrame({"latitude": [args.lat], "longitude": [args.lon], "radius": [args.radius]})
+        else:
+            points = read_points(args.input, args.radius, args.delimiter)
+    except (OSError, ValueError, pd.errors.ParserError) as e:
+        logging.error(f"Erreur lors de la lecture des points : {e}")
+        return 1
+
+    validation_error = validate_points(points)
+    if validation_error is not None:
+        logging.error(validation_error)
+        return 1
+
+    # La date de l'ANFR n'est récupérée en ligne que si la fraîcheur des données doit être vérifiée
+    anfr_last_modified_date = None if args.offline else get_anfr_data_last_modified_date()
+
+    results = run(points, args.operators, args.generations, anfr_last_modified_date,
+                  refresh_orientations=not args.offline)
+    if isinstance(results, str):
+        logging.error(results)
+        return 1
+
+    return write_or_log_results(results, args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,22 @@
+import codecs
+import hashlib
+import itertools
 import json
 import logging
 import os
+import threading
+from array import array
 from datetime import datetime
 
-import requests
+import numpy as np
 from requests.exceptions import RequestException
 
+import http_client
+import instrumentation
+
 # Constantes
 URL_BASE = "https://data.anfr.fr/api/records/2.0/downloadfile/format=json&refine.statut=En+service&refine.statut=Techniquement+op%C3%A9rationnel&resource_id=88ef0887-6b0f-4d3f-8545-6d64c8f597da"
 
-# Configuration de la journalisation
-logging.basicConfig(filename='app.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s', level=logging.INFO)
-
 # Liste des opérateurs de téléphonie mobile
 OPERATORS = [
     "ORANGE",
@@ -31,7 +36,41 @@ OPERATOR_NAME_MAPPING = {
     "SFR CARAIBES": "OUTREMER TELECOM",
 }
 
+# Taille des blocs lus lors du téléchargement et de l'analyse en flux des fichiers JSON
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Extension des fichiers du magasin colonnaire : seule copie locale des données ANFR
+STORE_EXT = ".npy"
+
+# Version du format des fichiers binaires des caches locaux : un fichier d'une autre version est reconstruit
+CACHE_FORMAT_VERSION = 1
+
+# Manifeste de chaque répertoire de cache : schéma, nombre de lignes, date des données et empreinte de chaque fichier
+MANIFEST_FILENAME = "manifest.json"
+
+# Colonnes du magasin colonnaire : les codes opérateur et génération sont les indices dans OPERATORS et GENERATIONS
+# sta_nm_anfr et l'empreinte de l'enregistrement servent à calculer les différences entre deux versions
+STORE_DTYPE = np.dtype([
+    ("latitude", np.float64),
+    ("longitude", np.float64),
+    ("station_id", np.int64),
+    ("operator_code", np.int8),
+    ("generation_code", np.int8),
+    ("sta_nm_anfr", "U24"),
+    ("record_hash", np.uint64),
+])
+
+# Journal des changements (une ligne JSON par nouvelle version d'un fichier opérateur/génération)
+CHANGELOG_FILENAME = "changelog.jsonl"
+
+# Extension des fichiers listant les stations modifiées dont les fichiers augmentés restent à mettre à jour
+DELTA_EXT = ".delta.json"
+
+_changelog_lock = threading.Lock()
+_manifest_lock = threading.Lock()
+
 # Fonction pour obtenir la date de dernière modification des données ANFR
+@instrumentation.timed("freshness_check")
 def get_anfr_data_last_modified_date():
     logging.info("Début de la fonction get_anfr_data_last_modified_date.")
 
@@ -41,8 +80,9 @@ def get_anfr_data_last_modified_date():
     
     try:
         logging.info("Envoi de la requête GET.")
-        response = requests.get(url)
+        response = http_client.get(url)
         response.raise_for_status()
+        instrumentation.count("bytes_downloaded", len(response.content))
         
         logging.info("Extraction de la date à partir de la réponse.")
         last_modified_text = response.text.split('language&quot;:&quot;fr&quot;,&quot;modified&quot;:&quot;', 1)[1]
@@ -71,20 +111,24 @@ def retrieve_or_update_antenna_data(operator, generation, local_data_dir, anfr_l
     logging.info(f"Récupération ou mise à jour des données de l'antenne pour {operator} {generation}.")
     
     # Construire le chemin du fichier
-    filepath = os.path.join(local_data_dir, f"{operator}_{generation}.json")
+    filepath = get_antenna_store_filepath(operator, generation, local_data_dir)
     
-    # Si le fichier n'existe pas ou si les données locales sont périmées, télécharger et rafraîchir les données
-    if not os.path.exists(filepath) or is_local_data_outdated(filepath, anfr_last_modified_date):
+    # Si le magasin n'existe pas, n'est pas au format attendu ou si les données locales sont périmées, télécharger et rafraîchir les données
+    if not is_antenna_store_valid(operator, generation, local_data_dir) or is_local_data_outdated(filepath, anfr_last_modified_date):
         return download_and_refresh_local_data(operator, generation, local_data_dir)
     
     # Lire les données de l'antenne et les retourner
     return read_antenna_data(operator, generation, local_data_dir)
 
 # Fonction pour télécharger les données de l'antenne
+@instrumentation.timed("download_antenna_data")
 def download_antenna_data(operator, generation, local_data_dir):
     # Log de l'information
     logging.info(f"Téléchargement des données de l'antenne pour {operator} {generation}.")
     
+    # Créer le chemin vers le magasin colonnaire local
+    filepath = get_antenna_store_filepath(operator, generation, local_data_dir)
+
     try:
         # Obtenir le nom de l'opérateur dans l'API
         operator_name_in_api = OPERATOR_NAME_MAPPING.get(operator, operator)
@@ -92,16 +136,41 @@ def download_antenna_data(operator, generation, local_data_dir):
         # Construire l'URL de l'API
         url = f"{URL_BASE}&refine.adm_lb_nom={operator_name_in_api}&refine.generation={generation}"
         
-        # Faire une requête GET à l'API et convertir la réponse en JSON
-        data = requests.get(url).json()
+        # Faire une requête GET en flux : la réponse n'est jamais chargée entièrement en mémoire.
+        # Elle n'est conditionnelle que si le magasin local est utilisable tel quel
+        if is_antenna_store_valid(operator, generation, local_data_dir):
+            response = http_client.conditional_get(url, filepath)
+        else:
+            response = http_client.get(url, stream=True)
+        with response:
+            # Si le serveur confirme que la copie locale est à jour, seule sa date est rafraîchie
+            if http_client.is_not_modified(response):
+                logging.info(f"Données inchangées sur le serveur pour {operator} {generation}.")
+                touch_local_data(operator, generation, local_data_dir)
+                return True
+            response.raise_for_status()
+
+            # Chaque bloc est analysé au fil de l'eau pour remplir le magasin colonnaire, sans conserver le JSON
+            records = stream_json_records(http_client.iter_counted_content(response, STREAM_CHUNK_SIZE))
+            store = create_antenna_store(records, operator, generation)
+            instrumentation.count("records_parsed", len(store))
 
-        # Créer le chemin vers le fichier local
-        filepath = os.path.join(local_data_dir, f"{operator}_{generation}.json")
+        # L'ancienne version est conservée en mémoire pour calculer les différences
+        previous_store = load_previous_antenna_store(operator, generation, local_data_dir)
 
-        # Ouvrir le fichier en mode écriture
-        with open(filepath, "w") as f:
-            # Ecrire les données dans le fichier en format JSON
-            json.dump(data, f)
+        # Le magasin n'est remplacé qu'une fois la réponse complète et valide
+        write_antenna_store(operator, generation, store, local_data_dir, response.headers.get("Last-Modified"))
+        delete_legacy_json_file(operator, generation, local_data_dir)
+
+        # Seules les stations ajoutées, modifiées ou supprimées seront à nouveau augmentées ;
+        # sans ancienne version utilisable, le fichier augmenté sera entièrement reconstruit
+        if previous_store is not None:
+            delta = diff_antenna_stores(previous_store, store)
+            record_antenna_delta(operator, generation, delta, local_data_dir, response)
+        else:
+            record_full_rebuild(operator, generation, local_data_dir)
+        # Mémoriser l'ETag et la date Last-Modified pour la prochaine vérification
+        http_client.store_cache_validators(url, filepath, response)
 
         # Si tout s'est bien passé, retourner True
         return True
@@ -113,6 +182,16 @@ def download_antenna_data(operator, generation, local_data_dir):
         # Retourner False
         return False
 
+# Fonction pour marquer les données locales comme vérifiées, sans les réécrire
+def touch_local_data(operator, generation, local_data_dir):
+    os.utime(get_antenna_store_filepath(operator, generation, local_data_dir))
+
+# Fonction pour supprimer l'ancienne copie JSON des données, remplacée par le magasin colonnaire
+def delete_legacy_json_file(operator, generation, local_data_dir):
+    json_filepath = os.path.join(local_data_dir, f"{operator}_{generation}.json")
+    if os.path.exists(json_filepath):
+        os.remove(json_filepath)
+
 # Fonction pour télécharger et rafraîchir les données locales
 def download_and_refresh_local_data(operator, generation, local_data_dir):
     # Log de l'information
@@ -123,28 +202,31 @@ def download_and_refresh_local_data(operator, generation, local_data_dir):
     # Si le téléchargement échoue, retourner None
     if not download_success:  
         return None
-    # Lire les données de l'antenne et les retourner
+    # Lire les données de l'antenne et les retourner (le magasin colonnaire a été construit pendant le téléchargement)
     return read_antenna_data(operator, generation, local_data_dir)
 
-# Fonction pour lire les données de l'antenne
+# Fonction pour lire les données de l'antenne : le magasin colonnaire est projeté en mémoire, pas chargé
+@instrumentation.timed("read_antenna_store")
 def read_antenna_data(operator, generation, local_data_dir):
     # Log de l'information
     logging.info(f"Lecture des données de l'antenne pour {operator} {generation}.")
 
-    # Créer le chemin vers le fichier local
-    filepath = os.path.join(local_data_dir, f"{operator}_{generation}.json")
-    
-    # Ouvrir le fichier en mode lecture
-    with open(filepath, "r") as f:
-        # Charger les données JSON et les retourner
-        data = json.load(f)
-    return data
+    # Un magasin absent ou d'un autre format que celui du manifeste n'est pas lu
+    if not is_antenna_store_valid(operator, generation, local_data_dir):
+        logging.error(f"Magasin colonnaire absent ou invalide pour {operator} {generation}.")
+        return None
+
+    return np.load(get_antenna_store_filepath(operator, generation, local_data_dir), mmap_mode="r")
 
 # Fonction pour vérifier si les données locales sont périmées
 def is_local_data_outdated(filepath, anfr_last_modified_date):
     # Log de l'information
     logging.info(f"Vérification si les données locales à {filepath} sont périmées.")
     
+    # Sans date ANFR connue (mode hors ligne ou échec de la récupération), les données locales sont conservées
+    if anfr_last_modified_date is None:
+        return False
+
     # Vérifier si le fichier local existe
     if os.path.exists(filepath):
         # Obtenir la date de dernière modification du fichier local
@@ -159,3 +241,259 @@ def is_local_data_outdated(filepath, anfr_last_modified_date):
             return True
     # Si le fichier local n'existe pas, retourner False
     return False
+
+# Fonction pour obtenir le chemin du magasin colonnaire de l'antenne
+def get_antenna_store_filepath(operator, generation, local_data_dir):
+    return os.path.join(local_data_dir, f"{operator}_{generation}{STORE_EXT}")
+
+# Fonction pour vérifier que le magasin colonnaire existe et correspond au format décrit par le manifeste
+def is_antenna_store_valid(operator, generation, local_data_dir):
+    return is_cache_file_valid(local_data_dir, f"{operator}_{generation}{STORE_EXT}", STORE_DTYPE)
+
+# Fonction pour convertir les enregistrements JSON de l'ANFR en tableau colonnaire
+def create_antenna_store(records, operator, generation):
+    # Les enregistrements sont parcourus une seule fois : seuls les champs utiles sont conservés
+    latitudes = array("d")
+    longitudes = array("d")
+    station_ids = array("q")
+    station_numbers = []
+    record_hashes = array("Q")
+    for record in records:
+        fields = record["fields"]
+        # Les coordonnées sont au format [longitude, latitude]
+        longitudes.append(fields["coordonnees"][0])
+        latitudes.append(fields["coordonnees"][1])
+        station_ids.append(int(fields["id"]))
+        station_numbers.append(fields.get("sta_nm_anfr", ""))
+        record_hashes.append(hash_record_fields(fields))
+
+    store = np.empty(len(latitudes), dtype=STORE_DTYPE)
+    store["latitude"] = np.frombuffer(latitudes, dtype=np.float64)
+    store["longitude"] = np.frombuffer(longitudes, dtype=np.float64)
+    store["station_id"] = np.frombuffer(station_ids, dtype=np.int64)
+    store["operator_code"] = OPERATORS.index(operator)
+    store["generation_code"] = GENERATIONS.index(generation)
+    store["sta_nm_anfr"] = station_numbers
+    store["record_hash"] = np.frombuffer(record_hashes, dtype=np.uint64)
+    return store
+
+# Fonction pour calculer l'empreinte (64 bits) des champs d'un enregistrement
+def hash_record_fields(fields):
+    digest = hashlib.blake2b(json.dumps(fields, sort_keys=True).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+# Fonction pour enregistrer le magasin colonnaire de l'antenne
+def write_antenna_store(operator, generation, store, local_data_dir, data_date=None):
+    filepath = get_antenna_store_filepath(operator, generation, local_data_dir)
+
+    # Écriture dans un fichier temporaire puis remplacement atomique
+    tmp_filepath = f"{filepath}.tmp"
+    with open(tmp_filepath, "wb") as f:
+        np.save(f, store)
+    os.replace(tmp_filepath, filepath)
+    record_cache_file(local_data_dir, os.path.basename(filepath), store, data_date)
+
+# Fonction pour extraire un à un les enregistrements d'un tableau JSON reçu par blocs d'octets
+def stream_json_records(chunks):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    started = False
+    finished = False
+
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            buffer = buffer[position:] + text_decoder.decode(b"", final=True)
+        else:
+            buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+
+        while not finished:
+            # Ignorer les espaces et les virgules entre les enregistrements
+            while position < len(buffer) and (buffer[position].isspace() or (started and buffer[position] == ",")):
+                position += 1
+            if position >= len(buffer):
+                break
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("La réponse n'est pas un tableau JSON.")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                finished = True
+                position += 1
+                break
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Enregistrement incomplet : attendre le bloc suivant
+                if chunk is None:
+                    raise
+                break
+            position = end
+            yield record
+
+    if not finished:
+        raise ValueError("Le tableau JSON est incomplet.")
+
+# Fonction pour lire le manifeste d'un répertoire de cache (vide s'il manque ou s'il est d'une autre version)
+def read_cache_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME), "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+    if manifest.get("format_version") != CACHE_FORMAT_VERSION:
+        manifest = {"format_version": CACHE_FORMAT_VERSION, "files": {}}
+    return manifest
+
+# Fonction pour décrire un schéma NumPy sous une forme enregistrable dans le manifeste
+def describe_dtype(dtype):
+    return [[name, dtype.fields[name][0].str] for name in dtype.names]
+
+# Fonction pour calculer l'empreinte d'un fichier, lu par blocs
+def compute_file_checksum(filepath):
+    digest = hashlib.blake2b()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Fonction pour enregistrer dans le manifeste le schéma, la date et l'empreinte d'un fichier de cache
+def record_cache_file(directory, filename, array, data_date=None):
+    filepath = os.path.join(directory, filename)
+    entry = {
+        "schema": describe_dtype(array.dtype),
+        "rows": len(array),
+        "size": os.path.getsize(filepath),
+        "checksum": compute_file_checksum(filepath),
+        "data_date": data_date,
+        "written": datetime.now().strftime("%d-%m-%Y %H:%M:%S"),
+    }
+
+    with _manifest_lock:
+        manifest = read_cache_manifest(directory)
+        manifest["files"][filename] = entry
+        manifest_filepath = os.path.join(directory, MANIFEST_FILENAME)
+        tmp_manifest_filepath = f"{manifest_filepath}.tmp"
+        with open(tmp_manifest_filepath, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_manifest_filepath, manifest_filepath)
+
+# Fonction pour vérifier qu'un fichier de cache existe, a le schéma attendu et n'a pas été modifié depuis son écriture
+def is_cache_file_valid(directory, filename, dtype):
+    filepath = os.path.join(directory, filename)
+    entry = read_cache_manifest(directory)["files"].get(filename)
+    if entry is None or not os.path.exists(filepath):
+        return False
+    # La taille suffit à détecter une copie tronquée sans relire le fichier ; l'empreinte reste disponible pour un contrôle complet
+    return entry["schema"] == describe_dtype(dtype) and entry["size"] == os.path.getsize(filepath)
+
+# Fonction pour obtenir la version de fichiers de cache d'après leur empreinte et leur date de données dans le manifeste.
+# La date de modification n'y entre pas : un fichier seulement marqué comme vérifié (réponse 304) garde sa version
+def get_cache_files_version(directory, filenames):
+    entries = read_cache_manifest(directory)["files"]
+    version = []
+    for filename in filenames:
+        entry = entries.get(filename)
+        if entry is not None:
+            version.append((filename, entry["checksum"], entry["data_date"]))
+        elif os.path.exists(os.path.join(directory, filename)):
+            # Fichier absent du manifeste (écrit par une ancienne version) : sa date et sa taille en tiennent lieu
+            stat = os.stat(os.path.join(directory, filename))
+            version.append((filename, stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+# Fonction pour obtenir la version des magasins colonnaires (empreinte et date des données de chaque fichier)
+def get_antenna_store_version(operators, generations, local_data_dir):
+    filenames = [os.path.basename(get_antenna_store_filepath(operator, generation, local_data_dir))
+                 for operator in operators for generation in generations]
+    return get_cache_files_version(local_data_dir, filenames)
+
+# Fonction pour charger en mémoire le magasin colonnaire actuel avant son remplacement
+def load_previous_antenna_store(operator, generation, local_data_dir):
+    # Un magasin absent, tronqué ou d'un autre format que celui du manifeste ne sert pas de référence
+    if not is_antenna_store_valid(operator, generation, local_data_dir):
+        return None
+    try:
+        store = np.load(get_antenna_store_filepath(operator, generation, local_data_dir))
+    except (OSError, ValueError) as e:
+        logging.error(f"Ancien magasin colonnaire illisible pour {operator} {generation} : {e}")
+        return None
+    # Un magasin d'un ancien format ne permet pas de calculer les différences
+    if store.dtype != STORE_DTYPE:
+        return None
+    return store
+
+# Fonction pour calculer les stations ajoutées, modifiées et supprimées entre deux versions d'un magasin
+def diff_antenna_stores(previous_store, store):
+    # Une station est identifiée par le couple (id, sta_nm_anfr)
+    previous_hashes = dict(zip(zip(previous_store["station_id"].tolist(), previous_store["sta_nm_anfr"].tolist()),
+                               previous_store["record_hash"].tolist()))
+    hashes = dict(zip(zip(store["station_id"].tolist(), store["sta_nm_anfr"].tolist()),
+                      store["record_hash"].tolist()))
+
+    inserted = sorted(key for key in hashes if key not in previous_hashes)
+    deleted = sorted(key for key in previous_hashes if key not in hashes)
+    updated = sorted(key for key, record_hash in hashes.items()
+                     if key in previous_hashes and previous_hashes[key] != record_hash)
+    return {"inserted": inserted, "updated": updated, "deleted": deleted}
+
+# Fonction pour journaliser une nouvelle version et mémoriser les stations à augmenter à nouveau
+def record_antenna_delta(operator, generation, delta, local_data_dir, response=None):
+    if not (delta["inserted"] or delta["updated"] or delta["deleted"]):
+        logging.info(f"Aucune station modifiée pour {operator} {generation}.")
+        return
+
+    logging.info(f"Stations modifiées pour {operator} {generation} : {len(delta['inserted'])} ajoutées, "
+                 f"{len(delta['updated'])} modifiées, {len(delta['deleted'])} supprimées.")
+
+    entry = {
+        "date": datetime.now().strftime("%d-%m-%Y %H:%M:%S"),
+        "operator": operator,
+        "generation": generation,
+        "etag": response.headers.get("ETag") if response is not None else None,
+        "last_modified": response.headers.get("Last-Modified") if response is not None else None,
+        "inserted": [list(key) for key in delta["inserted"]],
+        "updated": [list(key) for key in delta["updated"]],
+        "deleted": [list(key) for key in delta["deleted"]],
+    }
+
+    with _changelog_lock:
+        with open(os.path.join(local_data_dir, CHANGELOG_FILENAME), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    # Les identifiants touchés s'ajoutent à ceux qui n'ont pas encore été traités par l'augmentation
+    delta_filepath = os.path.join(local_data_dir, f"{operator}_{generation}{DELTA_EXT}")
+    affected_ids = {station_id for station_id, _ in delta["inserted"] + delta["updated"] + delta["deleted"]}
+    affected_ids.update(read_pending_delta(delta_filepath))
+    write_pending_delta(delta_filepath, affected_ids, is_full_rebuild_pending(delta_filepath))
+
+# Fonction pour demander la reconstruction complète du fichier augmenté, faute d'ancienne version à comparer
+def record_full_rebuild(operator, generation, local_data_dir):
+    logging.info(f"Aucune version précédente utilisable pour {operator} {generation} : reconstruction complète des orientations.")
+    delta_filepath = os.path.join(local_data_dir, f"{operator}_{generation}{DELTA_EXT}")
+    write_pending_delta(delta_filepath, read_pending_delta(delta_filepath), True)
+
+# Fonction pour enregistrer de manière atomique les stations en attente d'augmentation
+def write_pending_delta(delta_filepath, affected_ids, full_rebuild=False):
+    tmp_delta_filepath = f"{delta_filepath}.tmp"
+    with open(tmp_delta_filepath, "w") as f:
+        json.dump({"affected_ids": sorted(affected_ids), "full_rebuild": full_rebuild}, f)
+    os.replace(tmp_delta_filepath, delta_filepath)
+
+# Fonction pour lire les identifiants de stations en attente de mise à jour des fichiers augmentés
+def read_pending_delta(delta_filepath):
+    if not os.path.exists(delta_filepath):
+        return set()
+    with open(delta_filepath, "r") as f:
+        return set(json.load(f)["affected_ids"])
+
+# Fonction pour savoir si le fichier augmenté doit être entièrement reconstruit plutôt que mis à jour station par station
+def is_full_rebuild_pending(delta_filepath):
+    if not os.path.exists(delta_filepath):
+        return False
+    with open(delta_filepath, "r") as f:
+        return json.load(f).get("full_rebuild", False)
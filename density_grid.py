@@ -0,0 +1,156 @@
+import math
+
+import numpy as np
+
+# Rayon de la Terre en kilomètres, identique à celui de celldatawizard.haversine
+EARTH_RADIUS_KM = 6371.0
+
+# Taille des cellules de la grille, en degrés (environ 2,8 km en latitude)
+DEFAULT_CELL_SIZE = 0.025
+
+# Taille des tuiles utilisées pour regrouper les antennes en régions (métropole, chaque territoire d'outre-mer...)
+REGION_TILE_SIZE = 1.0
+
+
+# Grilles de comptage par groupe (génération × opérateur) avec tables de sommes cumulées (summed-area tables).
+# Chaque région occupée par des antennes a sa propre grille : la métropole et les territoires d'outre-mer
+# ne sont pas couverts par une seule grille mondiale, presque entièrement vide
+class DensityGrid:
+    def __init__(self, latitudes, longitudes, group_codes, n_groups, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.n_groups = n_groups
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        group_codes = np.asarray(group_codes)
+        valid = np.isfinite(latitudes) & np.isfinite(longitudes) & (group_codes >= 0)
+        latitudes, longitudes, group_codes = latitudes[valid], longitudes[valid], group_codes[valid]
+
+        self.regions = []
+        for members in self._find_regions(latitudes, longitudes):
+            self.regions.append(self._build_region(latitudes[members], longitudes[members], group_codes[members]))
+
+    # Regroupe les antennes en régions : composantes connexes des tuiles occupées
+    def _find_regions(self, latitudes, longitudes):
+        tiles = np.stack([np.floor(latitudes / REGION_TILE_SIZE), np.floor(longitudes / REGION_TILE_SIZE)], axis=1).astype(np.int64)
+        unique_tiles, tile_of_antenna = np.unique(tiles, axis=0, return_inverse=True)
+        tile_of_antenna = tile_of_antenna.ravel()
+        tile_positions = {tuple(tile): position for position, tile in enumerate(unique_tiles.tolist())}
+
+        region_of_tile = np.full(len(unique_tiles), -1, dtype=np.int64)
+        n_regions = 0
+        for start in range(len(unique_tiles)):
+            if region_of_tile[start] >= 0:
+                continue
+            region_of_tile[start] = n_regions
+            stack = [start]
+            while stack:
+                lat_tile, lon_tile = unique_tiles[stack.pop()]
+                for d_lat in (-1, 0, 1):
+                    for d_lon in (-1, 0, 1):
+                        neighbour = tile_positions.get((lat_tile + d_lat, lon_tile + d_lon))
+                        if neighbour is not None and region_of_tile[neighbour] < 0:
+                            region_of_tile[neighbour] = n_regions
+                            stack.append(neighbour)
+            n_regions += 1
+
+        region_of_antenna = region_of_tile[tile_of_antenna]
+        return [np.flatnonzero(region_of_antenna == region) for region in range(n_regions)]
+
+    def _build_region(self, latitudes, longitudes, group_codes):
+        lat_origin = math.floor(latitudes.min() / self.cell_size) * self.cell_size
+        lon_origin = math.floor(longitudes.min() / self.cell_size) * self.cell_size
+        rows = np.floor((latitudes - lat_origin) / self.cell_size).astype(np.int64)
+        cols = np.floor((longitudes - lon_origin) / self.cell_size).astype(np.int64)
+        n_rows = int(rows.max()) + 1
+        n_cols = int(cols.max()) + 1
+
+        counts = np.bincount((rows * n_cols + cols) * self.n_groups + group_codes,
+                             minlength=n_rows * n_cols * self.n_groups).reshape(n_rows, n_cols, self.n_groups)
+        # sums[i, j] = nombre d'antennes des cellules de lignes < i et de colonnes < j
+        sums = np.zeros((n_rows + 1, n_cols + 1, self.n_groups), dtype=np.int32)
+        sums[1:, 1:] = counts.cumsum(axis=0).cumsum(axis=1)
+        return {"lat_origin": lat_origin, "lon_origin": lon_origin, "n_rows": n_rows, "n_cols": n_cols, "sums": sums}
+
+    # Renvoie, pour chaque groupe, l'estimation du nombre d'antennes à moins de radius km du point,
+    # ainsi qu'un minimum (cellules entièrement dans le cercle) et un maximum (cellules qui recoupent le cercle).
+    # Renvoie None si le cercle atteint un pôle ou l'antiméridien : le calcul exact doit alors être utilisé
+    def query(self, lat, lon, radius):
+        angular_radius = radius / EARTH_RADIUS_KM
+        lat_radius = math.degrees(angular_radius)
+        if lat - lat_radius <= -90 or lat + lat_radius >= 90 or angular_radius >= math.pi / 2:
+            return None
+        lon_half_width = longitude_half_width(lat, lat, angular_radius)
+        if lon - lon_half_width < -180 or lon + lon_half_width > 180:
+            return None
+
+        estimate = np.zeros(self.n_groups, dtype=np.int64)
+        lower = np.zeros(self.n_groups, dtype=np.int64)
+        upper = np.zeros(self.n_groups, dtype=np.int64)
+        for region in self.regions:
+            region_estimate, region_lower, region_upper = self._query_region(region, lat, lon, angular_radius, lat_radius)
+            estimate += region_estimate
+            lower += region_lower
+            upper += region_upper
+        return estimate, lower, upper
+
+    def _query_region(self, region, lat, lon, angular_radius, lat_radius):
+        cell = self.cell_size
+        n_rows, n_cols, sums = region["n_rows"], region["n_cols"], region["sums"]
+        zero = np.zeros(self.n_groups, dtype=np.int64)
+
+        # Lignes de la grille qui recoupent la bande de latitude du cercle
+        first_row = max(int(math.floor((lat - lat_radius - region["lat_origin"]) / cell)), 0)
+        last_row = min(int(math.floor((lat + lat_radius - region["lat_origin"]) / cell)), n_rows - 1)
+        if first_row > last_row:
+            return zero, zero, zero
+        rows = np.arange(first_row, last_row + 1)
+        row_bottoms = region["lat_origin"] + rows * cell
+        row_tops = row_bottoms + cell
+
+        # Parties des lignes dans la bande de latitude du cercle, où la demi-largeur en longitude est définie
+        band_bottoms = np.maximum(row_bottoms, lat - lat_radius)
+        band_tops = np.minimum(row_tops, lat + lat_radius)
+        # La demi-largeur est unimodale en latitude : son maximum sur une ligne est au sommet de la courbe
+        # ramené dans la ligne, son minimum à l'une des deux extrémités de la ligne
+        peak = peak_latitude(lat, angular_radius)
+        outer_widths = longitude_half_width(np.clip(peak, band_bottoms, band_tops), lat, angular_radius)
+        inside_band = (row_bottoms >= lat - lat_radius) & (row_tops <= lat + lat_radius)
+        inner_widths = np.where(inside_band, np.minimum(longitude_half_width(row_bottoms, lat, angular_radius),
+                                                        longitude_half_width(row_tops, lat, angular_radius)), -1.0)
+        row_centers = row_bottoms + cell / 2
+        center_in_band = np.abs(row_centers - lat) <= lat_radius
+        center_widths = np.where(center_in_band, longitude_half_width(np.clip(row_centers, lat - lat_radius, lat + lat_radius),
+                                                                     lat, angular_radius), -1.0)
+
+        lon_offset = lon - region["lon_origin"]
+        # Cellules qui recoupent le cercle
+        outer = self._sum_rows(sums, rows, np.floor((lon_offset - outer_widths) / cell), np.floor((lon_offset + outer_widths) / cell), n_cols)
+        # Cellules entièrement dans le cercle
+        inner = self._sum_rows(sums, rows, np.ceil((lon_offset - inner_widths) / cell), np.floor((lon_offset + inner_widths) / cell) - 1,
+                               n_cols, inner_widths >= 0)
+        # Cellules dont le centre est dans le cercle
+        center = self._sum_rows(sums, rows, np.ceil((lon_offset - center_widths) / cell - 0.5),
+                                np.floor((lon_offset + center_widths) / cell - 0.5), n_cols, center_widths >= 0)
+        return center, inner, outer
+
+    # Somme des comptages des colonnes [first_cols, last_cols] de chaque ligne, par les sommes cumulées
+    def _sum_rows(self, sums, rows, first_cols, last_cols, n_cols, valid=True):
+        first_cols = np.clip(first_cols, 0, n_cols).astype(np.int64)
+        last_cols = np.clip(last_cols + 1, 0, n_cols).astype(np.int64)
+        valid = valid & (last_cols > first_cols)
+        rows, first_cols, last_cols = rows[valid], first_cols[valid], last_cols[valid]
+        strips = sums[rows + 1, last_cols] - sums[rows, last_cols] - sums[rows + 1, first_cols] + sums[rows, first_cols]
+        return strips.sum(axis=0, dtype=np.int64)
+
+
+# Fonction pour calculer la demi-largeur en longitude (en degrés) d'une calotte sphérique à une latitude donnée
+def longitude_half_width(latitudes, center_lat, angular_radius):
+    latitudes = np.radians(latitudes)
+    center_lat = math.radians(center_lat)
+    cosine = (math.cos(angular_radius) - math.sin(center_lat) * np.sin(latitudes)) / (math.cos(center_lat) * np.cos(latitudes))
+    return np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
+
+# Fonction pour obtenir la latitude (en degrés) où la calotte sphérique est la plus large en longitude
+def peak_latitude(center_lat, angular_radius):
+    return math.degrees(math.asin(min(1.0, math.sin(math.radians(center_lat)) / math.cos(angular_radius))))
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import instrumentation
+
+# Taille du pool de connexions persistantes par hôte, alignée sur le nombre de téléchargements simultanés.
+# Le pool est bloquant : c'est aussi le nombre maximal de requêtes simultanées vers un même hôte.
+HTTP_POOL_SIZE = 8
+
+# Délais d'attente (en secondes) pour l'établissement de la connexion et pour la lecture de la réponse
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 60
+
+# Nouvelles tentatives avec attente exponentielle (backoff_factor × 2^n secondes) sur erreurs réseau, 429 et 5xx
+HTTP_MAX_RETRIES = 5
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Répertoire du cache HTTP et fichier d'index des validateurs (ETag / Last-Modified) par ressource
+HTTP_CACHE_DIR = "http_cache"
+HTTP_CACHE_INDEX = "index.json"
+
+# Taille des blocs écrits sur le disque lors d'un téléchargement
+HTTP_CHUNK_SIZE = 1024 * 1024
+
+_cache_lock = threading.Lock()
+_session = None
+_session_lock = threading.Lock()
+
+# Fonction pour modifier la configuration du client HTTP partagé (la session est recréée)
+def configure(pool_size=None, connect_timeout=None, read_timeout=None, max_retries=None, backoff_factor=None):
+    global HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES, HTTP_BACKOFF_FACTOR, _session
+    with _session_lock:
+        if pool_size is not None:
+            HTTP_POOL_SIZE = pool_size
+        if connect_timeout is not None:
+            HTTP_CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            HTTP_READ_TIMEOUT = read_timeout
+        if max_retries is not None:
+            HTTP_MAX_RETRIES = max_retries
+        if backoff_factor is not None:
+            HTTP_BACKOFF_FACTOR = backoff_factor
+        if _session is not None:
+            _session.close()
+        _session = None
+
+# Fonction pour créer une session avec pool de connexions persistantes et nouvelles tentatives
+def create_session():
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=HTTP_RETRY_STATUSES,
+        allowed_methods=["GET", "HEAD"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, pool_block=True, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Fonction pour obtenir la session partagée par tous les téléchargements
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+# Fonction pour envoyer une requête GET avec la session partagée et les délais d'attente par défaut
+def get(url, **kwargs):
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_session().get(url, **kwargs)
+
+# Fonction pour lire une réponse en flux en comptant les octets reçus
+def iter_counted_content(response, chunk_size):
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        instrumentation.count("bytes_downloaded", len(chunk))
+        yield chunk
+
+# Fonction pour obtenir le chemin du fichier d'index du cache
+def get_cache_index_path():
+    return os.path.join(HTTP_CACHE_DIR, HTTP_CACHE_INDEX)
+
+# Fonction pour charger l'index du cache (vide s'il n'existe pas ou s'il est illisible)
+def load_cache_index():
+    try:
+        with open(get_cache_index_path(), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+# Fonction pour enregistrer l'index du cache de manière atomique
+def save_cache_index(index):
+    os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+    index_path = get_cache_index_path()
+    tmp_index_path = f"{index_path}.tmp"
+    with open(tmp_index_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_index_path, index_path)
+
+# Fonction pour construire les en-têtes conditionnels d'une ressource déjà téléchargée
+def get_cache_headers(url, local_path):
+    with _cache_lock:
+        entry = load_cache_index().get(os.path.abspath(local_path))
+
+    # Les validateurs ne valent que pour la même URL et si la copie locale n'a pas changé
+    if entry is None or entry["url"] != url:
+        return {}
+    if not os.path.exists(local_path) or os.path.getsize(local_path) != entry["size"]:
+        return {}
+
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+# Fonction pour mémoriser les validateurs renvoyés par le serveur pour une copie locale
+def store_cache_validators(url, local_path, response):
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    key = os.path.abspath(local_path)
+
+    with _cache_lock:
+        index = load_cache_index()
+        if etag is None and last_modified is None:
+            index.pop(key, None)
+        else:
+            index[key] = {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "size": os.path.getsize(local_path),
+            }
+        save_cache_index(index)
+
+# Fonction pour envoyer une requête GET conditionnelle (en flux) pour une copie locale
+def conditional_get(url, local_path, headers=None, **kwargs):
+    request_headers = dict(headers or {})
+    request_headers.update(get_cache_headers(url, local_path))
+    return get(url, headers=request_headers, stream=True, **kwargs)
+
+# Fonction pour savoir si le serveur a confirmé que la copie locale est à jour
+def is_not_modified(response):
+    return response.status_code == 304
+
+# Fonction pour mettre à jour une copie locale d'une ressource, en ne la téléchargeant que si elle a changé
+def fetch_cached(url, local_path):
+    with conditional_get(url, local_path) as response:
+        if is_not_modified(response):
+            logging.info(f"Ressource inchangée sur le serveur, copie locale conservée : {local_path}")
+            return False
+        response.raise_for_status()
+
+        # Écriture dans un fichier temporaire puis remplacement atomique
+        local_dir = os.path.dirname(local_path)
+        if local_dir:
+            os.makedirs(local_dir, exist_ok=True)
+        tmp_path = f"{local_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in iter_counted_content(response, HTTP_CHUNK_SIZE):
+                    f.write(chunk)
+            os.replace(tmp_path, local_path)
+        except Exception:
+            # Une copie partielle ne doit jamais remplacer la copie précédente
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    store_cache_validators(url, local_path, response)
+    logging.info(f"Ressource téléchargée : {local_path}")
+    return True
@@ -0,0 +1,248 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Nombre d'enregistrements de requêtes gardés en mémoire pour l'export
+DEFAULT_MAX_RECORDS = 1000
+
+# Préfixe des métriques au format Prometheus
+METRICS_PREFIX = "celldatawizard"
+
+_enabled = False
+_trace_memory = False
+_records = deque(maxlen=DEFAULT_MAX_RECORDS)
+_totals = {"requests": 0, "stages": {}, "counters": {}}
+_totals_lock = threading.Lock()
+_current_record = contextvars.ContextVar("instrumentation_record", default=None)
+_null_context = contextlib.nullcontext()
+
+
+# Mesures d'une requête : durée de chaque étape, compteurs (octets téléchargés, enregistrements lus, lignes filtrées...)
+# et pic de mémoire. Les étapes exécutées dans d'autres threads (téléchargements parallèles) y sont ajoutées sous verrou
+class RequestRecord:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.thread = threading.get_ident()
+        self.duration = None
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+        # Pic de mémoire résidente du processus depuis son démarrage, et sa hausse pendant la requête
+        self.process_peak_rss_bytes = None
+        self.peak_rss_growth_bytes = None
+        self.start_peak_rss_bytes = get_peak_rss_bytes()
+        self.peak_traced_bytes = None
+        self.lock = threading.Lock()
+
+    def add_stage(self, name, start, duration):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += duration
+            self.events.append({"name": name, "start": start - self.start, "duration": duration, "thread": threading.get_ident()})
+
+    def add_count(self, name, amount):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self):
+        with self.lock:
+            return {"name": self.name, "attributes": dict(self.attributes), "started_at": self.started_at, "thread": self.thread,
+                    "seconds": self.duration, "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                    "counters": dict(self.counters), "process_peak_rss_bytes": self.process_peak_rss_bytes,
+                    "peak_rss_growth_bytes": self.peak_rss_growth_bytes,
+                    "peak_traced_bytes": self.peak_traced_bytes, "events": list(self.events)}
+
+
+# Mesure de la durée d'une étape, ajoutée à la requête en cours et aux totaux du processus
+class Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        record = _current_record.get()
+        if record is not None:
+            record.add_stage(self.name, self.start, duration)
+        with _totals_lock:
+            stage = _totals["stages"].setdefault(self.name, {"calls": 0, "seconds": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += duration
+        return False
+
+
+# Fonction pour activer les mesures ; trace_memory active aussi tracemalloc (pic de mémoire Python par requête, plus coûteux)
+def enable(trace_memory=False, max_records=DEFAULT_MAX_RECORDS):
+    global _enabled, _trace_memory, _records
+    _records = deque(_records, maxlen=max_records)
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def is_enabled():
+    return _enabled
+
+# Fonction pour mesurer une étape : `with instrumentation.stage("distances"):`. Sans mesures, le contexte ne fait rien
+def stage(name):
+    if not _enabled:
+        return _null_context
+    return Stage(name)
+
+# Décorateur mesurant la durée de chaque appel d'une fonction comme une étape
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Fonction pour ajouter une quantité à un compteur de la requête en cours et aux totaux du processus
+def count(name, amount=1):
+    if not _enabled:
+        return
+    record = _current_record.get()
+    if record is not None:
+        record.add_count(name, amount)
+    with _totals_lock:
+        _totals["counters"][name] = _totals["counters"].get(name, 0) + amount
+
+# Fonction pour qu'une fonction exécutée dans un autre thread rattache ses mesures à la requête en cours.
+# La fonction renvoyée peut s'exécuter dans plusieurs threads à la fois : chaque appel y active l'enregistrement
+def bind(function):
+    record = _current_record.get()
+    if not _enabled or record is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = _current_record.set(record)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current_record.reset(token)
+    return wrapper
+
+# Mesure d'une requête complète : `with instrumentation.request("calculate_density", radius=2) as record:`.
+# L'enregistrement est journalisé et conservé pour l'export ; sans mesures, le contexte renvoie None
+@contextlib.contextmanager
+def request(name, **attributes):
+    if not _enabled:
+        yield None
+        return
+
+    record = RequestRecord(name, attributes)
+    token = _current_record.set(record)
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    try:
+        yield record
+    finally:
+        _current_record.reset(token)
+        record.duration = time.perf_counter() - record.start
+        # ru_maxrss est le pic du processus entier : seule sa hausse pendant la requête lui est attribuable
+        record.process_peak_rss_bytes = get_peak_rss_bytes()
+        if record.process_peak_rss_bytes is not None:
+            record.peak_rss_growth_bytes = record.process_peak_rss_bytes - record.start_peak_rss_bytes
+        if _trace_memory and tracemalloc.is_tracing():
+            # Pic de la mémoire allouée par Python pendant la requête (et les requêtes simultanées)
+            record.peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+        _records.append(record)
+        with _totals_lock:
+            _totals["requests"] += 1
+        logging.info(f"Mesures de la requête {name} : {json.dumps(summarize_record(record), ensure_ascii=False)}")
+
+# Fonction pour obtenir le pic de mémoire résidente du processus, en octets (None si indisponible)
+def get_peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en kilo-octets sous Linux et en octets sous macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# Fonction pour résumer un enregistrement (sans la liste détaillée des événements)
+def summarize_record(record):
+    summary = record.to_dict()
+    del summary["events"]
+    return summary
+
+def get_records():
+    return [record.to_dict() for record in list(_records)]
+
+def get_last_record():
+    return _records[-1].to_dict() if _records else None
+
+def clear():
+    _records.clear()
+    with _totals_lock:
+        _totals.update({"requests": 0, "stages": {}, "counters": {}})
+
+# Fonction pour formater les totaux du processus au format texte de Prometheus
+def format_prometheus():
+    with _totals_lock:
+        requests = _totals["requests"]
+        stages = {name: dict(stage) for name, stage in _totals["stages"].items()}
+        counters = dict(_totals["counters"])
+
+    lines = [f"# TYPE {METRICS_PREFIX}_requests_total counter", f"{METRICS_PREFIX}_requests_total {requests}",
+             f"# TYPE {METRICS_PREFIX}_stage_seconds_total counter"]
+    lines += [f'{METRICS_PREFIX}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}' for name, stage in sorted(stages.items())]
+    lines.append(f"# TYPE {METRICS_PREFIX}_stage_calls_total counter")
+    lines += [f'{METRICS_PREFIX}_stage_calls_total{{stage="{name}"}} {stage["calls"]}' for name, stage in sorted(stages.items())]
+    for name, value in sorted(counters.items()):
+        lines += [f"# TYPE {METRICS_PREFIX}_{name}_total counter", f"{METRICS_PREFIX}_{name}_total {value}"]
+    process_peak_rss_bytes = get_peak_rss_bytes()
+    if process_peak_rss_bytes is not None:
+        lines += [f"# TYPE {METRICS_PREFIX}_process_peak_rss_bytes gauge", f"{METRICS_PREFIX}_process_peak_rss_bytes {process_peak_rss_bytes}"]
+    return "\n".join(lines) + "\n"
+
+# Fonction pour écrire les mesures au format texte de Prometheus
+def write_prometheus(path):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(format_prometheus())
+
+# Fonction pour écrire les requêtes mesurées au format JSON « Trace Event » (chrome://tracing, Perfetto)
+def write_json_trace(path, records=None):
+    records = get_records() if records is None else records
+    events = []
+    pid = os.getpid()
+    for record in records:
+        start_us = record["started_at"] * 1e6
+        events.append({"name": record["name"], "ph": "X", "ts": start_us, "dur": record["seconds"] * 1e6, "pid": pid, "tid": record["thread"],
+                       "args": {"attributes": record["attributes"], "counters": record["counters"],
+                                "process_peak_rss_bytes": record["process_peak_rss_bytes"],
+                                "peak_rss_growth_bytes": record["peak_rss_growth_bytes"], "peak_traced_bytes": record["peak_traced_bytes"]}})
+        events += [{"name": event["name"], "ph": "X", "ts": start_us + event["start"] * 1e6, "dur": event["duration"] * 1e6,
+                    "pid": pid, "tid": event["thread"]} for event in record["events"]]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
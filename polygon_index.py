@@ -0,0 +1,93 @@
+import json
+import logging
+import math
+
+import numpy as np
+import shapely
+
+# Types de géométries acceptés comme zones de calcul
+POLYGON_TYPES = ("Polygon", "MultiPolygon")
+
+# Ellipsoïde WGS84 : demi-grand axe (m) et aplatissement
+WGS84_SEMI_MAJOR_AXIS = 6378137.0
+WGS84_FLATTENING = 1 / 298.257223563
+
+
+# Index de polygones (communes, IRIS, emprises GeoJSON...) : arbre STRtree sur les géométries préparées,
+# pour affecter toutes les antennes à leurs polygones en une seule requête vectorisée
+class PolygonIndex:
+    def __init__(self, ids, geometries):
+        self.ids = list(ids)
+        self.geometries = np.asarray(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        # Surfaces géodésiques (ellipsoïde WGS84) en km², et centres utilisés pour l'orientation des antennes
+        self.areas = geodesic_areas(self.geometries)
+        self.centers = shapely.point_on_surface(self.geometries)
+        self.center_latitudes = shapely.get_y(self.centers)
+        self.center_longitudes = shapely.get_x(self.centers)
+
+    # Renvoie les paires (point, polygone) où le point est dans le polygone ou sur son bord
+    def assign_points(self, points):
+        point_positions, polygon_positions = self.tree.query(points, predicate="intersects")
+        return point_positions, polygon_positions
+
+
+# Fonction pour charger les polygones d'un fichier GeoJSON (FeatureCollection, Feature ou géométrie seule)
+def load_geojson_polygons(path, id_property=None):
+    with open(path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+
+    if data.get("type") == "FeatureCollection":
+        features = data.get("features", [])
+    elif data.get("type") == "Feature":
+        features = [data]
+    else:
+        features = [{"type": "Feature", "geometry": data, "properties": {}}]
+
+    ids = []
+    geometries = []
+    for position, feature in enumerate(features):
+        geometry = feature.get("geometry")
+        if not geometry or geometry.get("type") not in POLYGON_TYPES:
+            logging.warning(f"Élément {position} du fichier {path} ignoré : ce n'est pas un polygone.")
+            continue
+        properties = feature.get("properties") or {}
+        if id_property is not None:
+            polygon_id = properties.get(id_property, position)
+        else:
+            polygon_id = feature.get("id", position)
+        ids.append(polygon_id)
+        geometries.append(shapely.from_geojson(json.dumps(geometry)))
+    return ids, geometries
+
+# Fonction pour calculer les surfaces géodésiques (km²) de polygones en longitude/latitude, en une passe vectorisée.
+# Les latitudes sont converties en latitudes authaliques : la sphère authalique conserve les surfaces de l'ellipsoïde WGS84
+def geodesic_areas(geometries):
+    parts, part_geometries = shapely.get_parts(geometries, return_index=True)
+    rings, ring_parts = shapely.get_rings(parts, return_index=True)
+    # Le premier anneau de chaque polygone est son contour extérieur, les suivants sont des trous
+    is_exterior = np.ones(len(rings), dtype=bool)
+    is_exterior[1:] = ring_parts[1:] != ring_parts[:-1]
+    coords, coord_rings = shapely.get_coordinates(rings, return_index=True)
+
+    eccentricity = math.sqrt(WGS84_FLATTENING * (2 - WGS84_FLATTENING))
+    authalic_q_pole = authalic_q(1.0, eccentricity)
+    authalic_radius = WGS84_SEMI_MAJOR_AXIS * math.sqrt(authalic_q_pole / 2)
+    latitudes = np.arcsin(np.clip(authalic_q(np.sin(np.radians(coords[:, 1])), eccentricity) / authalic_q_pole, -1.0, 1.0))
+    longitudes = np.radians(coords[:, 0])
+
+    # Excès sphérique du trapèze entre chaque côté et le pôle ; les anneaux sont fermés, le dernier point répète le premier
+    same_ring = coord_rings[1:] == coord_rings[:-1]
+    half_tan_start = np.tan(latitudes[:-1][same_ring] / 2)
+    half_tan_end = np.tan(latitudes[1:][same_ring] / 2)
+    delta_lon = np.remainder(longitudes[1:][same_ring] - longitudes[:-1][same_ring] + math.pi, 2 * math.pi) - math.pi
+    excess = 2 * np.arctan2(np.tan(delta_lon / 2) * (half_tan_start + half_tan_end), 1 + half_tan_start * half_tan_end)
+    ring_areas = np.abs(np.bincount(coord_rings[1:][same_ring], weights=excess, minlength=len(rings))) * authalic_radius ** 2
+
+    signed_areas = np.where(is_exterior, ring_areas, -ring_areas)
+    return np.bincount(part_geometries[ring_parts], weights=signed_areas, minlength=len(geometries)) / 1e6
+
+def authalic_q(sin_latitudes, eccentricity):
+    e_sin = eccentricity * sin_latitudes
+    return (1 - eccentricity ** 2) * (sin_latitudes / (1 - e_sin ** 2) - np.log((1 - e_sin) / (1 + e_sin)) / (2 * eccentricity))
@@ -0,0 +1,111 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Nombre maximal de résultats gardés en mémoire
+DEFAULT_MAX_ENTRIES = 1024
+
+# Nombre maximal de résultats gardés sur le disque (si le niveau disque est activé)
+DEFAULT_MAX_DISK_ENTRIES = 100_000
+
+# Précision des coordonnées dans les clés : 5 décimales, soit environ 1 m
+DEFAULT_COORD_DECIMALS = 5
+
+
+# Cache LRU des résultats de calcul, avec un niveau disque SQLite optionnel.
+# Les clés contiennent la version des données : quand la version change, tout le cache est invalidé
+class ResultCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, disk_path=None, max_disk_entries=DEFAULT_MAX_DISK_ENTRIES,
+                 coord_decimals=DEFAULT_COORD_DECIMALS):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.coord_decimals = coord_decimals
+        self.entries = OrderedDict()
+        self.data_version = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.connection = None
+        if disk_path is not None:
+            self.connection = sqlite3.connect(disk_path, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results "
+                                    "(key TEXT PRIMARY KEY, data_version TEXT, value TEXT, last_used REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self.connection.commit()
+
+    # Construit la clé d'une requête : coordonnées arrondies, rayon, opérateurs et générations dans l'ordre demandé
+    def make_key(self, operators, generations, lat, lon, radius):
+        return json.dumps([round(float(lat), self.coord_decimals), round(float(lon), self.coord_decimals), float(radius),
+                           list(operators), list(generations)])
+
+    # Invalide le cache si la version des données a changé depuis le dernier appel
+    def set_data_version(self, data_version):
+        with self.lock:
+            if data_version == self.data_version:
+                return
+            self.entries.clear()
+            self.data_version = data_version
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM results WHERE data_version != ?", (data_version,))
+                self.connection.commit()
+
+    # Renvoie le résultat mémorisé pour une clé, ou None
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            if self.connection is not None:
+                row = self.connection.execute("SELECT value FROM results WHERE key = ? AND data_version = ?",
+                                              (key, self.data_version)).fetchone()
+                if row is not None:
+                    self.connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self.connection.commit()
+                    value = json.loads(row[0])
+                    self._store_in_memory(key, value)
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    # Mémorise le résultat d'une clé (en mémoire, et sur le disque si le niveau disque est activé)
+    def put(self, key, value):
+        with self.lock:
+            self._store_in_memory(key, value)
+            if self.connection is not None:
+                self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                        (key, self.data_version, json.dumps(value, default=to_json_value), time.time()))
+                # Les résultats les moins récemment utilisés au-delà de la limite sont supprimés
+                self.connection.execute("DELETE FROM results WHERE key IN (SELECT key FROM results "
+                                        "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_disk_entries,))
+                self.connection.commit()
+
+    def _store_in_memory(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    # Renvoie les compteurs du cache
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "entries": len(self.entries)}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM results")
+                self.connection.commit()
+
+
+# Fonction pour convertir les nombres NumPy des résultats en nombres JSON
+def to_json_value(value):
+    return value.item()
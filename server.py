@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import celldatawizard
+import instrumentation
+from cli import validate_points
+from data_update import GENERATIONS, OPERATORS, get_anfr_data_last_modified_date
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8750
+
+# Nombre de threads pour les calculs : NumPy libère le GIL pendant l'essentiel du travail
+DEFAULT_QUERY_WORKERS = os.cpu_count() or 1
+
+# Intervalle (en secondes) entre deux rafraîchissements des données en arrière-plan, 0 pour les désactiver
+DEFAULT_REFRESH_INTERVAL = 3600
+
+# Taille maximale du corps d'une requête, en octets
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+# Erreur renvoyée au client avec un code HTTP
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Serveur de requêtes : le jeu d'antennes et ses index restent en mémoire, et sont remplacés d'un bloc
+# lorsqu'un rafraîchissement en arrière-plan se termine
+class QueryServer:
+    def __init__(self, query_workers=DEFAULT_QUERY_WORKERS, refresh_interval=DEFAULT_REFRESH_INTERVAL, offline=False):
+        self.refresh_interval = refresh_interval
+        self.offline = offline
+        self.query_executor = ThreadPoolExecutor(max_workers=query_workers)
+        # Un seul rafraîchissement à la fois, sur un thread dédié pour ne pas retarder les requêtes
+        self.refresh_executor = ThreadPoolExecutor(max_workers=1)
+        self.refresh_lock = threading.Lock()
+        # Jeu de données en service (DataFrame et index), remplacé en une seule affectation
+        self.dataset = None
+        self.loaded_at = None
+
+    # Charge (ou recharge) les données, prépare les index, puis remplace le jeu de données en service
+    def load_dataset(self, check_online):
+        if not self.refresh_lock.acquire(blocking=False):
+            logging.info("Rafraîchissement des données déjà en cours.")
+            return False
+        try:
+            with instrumentation.request("load_dataset", check_online=check_online):
+                anfr_last_modified_date = get_anfr_data_last_modified_date() if check_online else None
+                dataset = celldatawizard.prepare_antenna_dataset(OPERATORS, GENERATIONS, anfr_last_modified_date,
+                                                                 refresh_orientations=check_online)
+                if isinstance(dataset, str):
+                    logging.error(dataset)
+                    return False
+
+                # Les index sont construits avant la bascule : la première requête sur les nouvelles données reste rapide
+                with instrumentation.stage("warm_caches"):
+                    dataset.warm()
+                if dataset is not self.dataset:
+                    self.dataset = dataset
+                    logging.info(f"Jeu de données chargé : {len(dataset.df)} antennes.")
+                self.loaded_at = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+                return True
+        finally:
+            self.refresh_lock.release()
+
+    # Calcule les résultats d'une liste de points sur le jeu de données en service
+    def query(self, points, operators, generations):
+        # La référence locale garde le jeu de données et ses index jusqu'à la fin du calcul, même après une bascule
+        dataset = self.dataset
+        if dataset is None:
+            raise RequestError(503, "Les données ne sont pas encore chargées.")
+        with instrumentation.request("server_query", points=len(points)):
+            with instrumentation.stage("batch_kernel"):
+                result = celldatawizard.calculate_antenna_density_and_counts_batch(
+                    operators, generations, dataset.df,
+                    points["latitude"].astype(float).values, points["longitude"].astype(float).values, points["radius"].astype(float).values,
+                )
+            return format_results(result, len(points))
+
+    # Calcule les résultats approchés (grilles de sommes cumulées) d'une liste de points, avec un encadrement des comptages
+    def query_approximate(self, points, operators, generations):
+        dataset = self.dataset
+        if dataset is None:
+            raise RequestError(503, "Les données ne sont pas encore chargées.")
+        results = []
+        with instrumentation.request("server_query_approximate", points=len(points)):
+            for lat, lon, radius in zip(points["latitude"].astype(float), points["longitude"].astype(float), points["radius"].astype(float)):
+                densities, antenna_counts, count_bounds = celldatawizard.calculate_antenna_density_and_counts_approximate(
+                    operators, generations, dataset.df, lat, lon, radius)
+                results.append({"densities": densities, "antenna_counts": antenna_counts, "count_bounds": count_bounds})
+        return results
+
+    # Traite une requête HTTP et renvoie le code et le corps de la réponse
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        loop = asyncio.get_running_loop()
+
+        if url.path == "/health":
+            if method != "GET":
+                raise RequestError(405, "Méthode non autorisée.")
+            dataset = self.dataset
+            return 200, {"status": "ok" if dataset is not None else "loading",
+                         "antennas": 0 if dataset is None else len(dataset.df), "loaded_at": self.loaded_at}
+
+        if url.path == "/reload":
+            if method != "POST":
+                raise RequestError(405, "Méthode non autorisée.")
+            loop.run_in_executor(self.refresh_executor, self.load_dataset, not self.offline)
+            return 202, {"status": "reloading"}
+
+        if url.path == "/metrics":
+            if method != "GET":
+                raise RequestError(405, "Méthode non autorisée.")
+            if not instrumentation.is_enabled():
+                raise RequestError(404, "Instrumentation désactivée (option --instrument).")
+            return 200, instrumentation.format_prometheus()
+
+        if url.path == "/density":
+            if method == "GET":
+                points, operators, generations, approximate = parse_query_string(url.query)
+            elif method == "POST":
+                points, operators, generations, approximate = parse_json_body(body)
+            else:
+                raise RequestError(405, "Méthode non autorisée.")
+            query = self.query_approximate if approximate else self.query
+            results = await loop.run_in_executor(self.query_executor, query, points, operators, generations)
+            return 200, results[0] if method == "GET" else {"results": results}
+
+        raise RequestError(404, "Ressource introuvable.")
+
+    # Lit les requêtes d'une connexion (HTTP/1.1, connexions persistantes) et y répond
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                content_length = int(headers.get("content-length", 0))
+                if content_length > MAX_BODY_SIZE:
+                    await write_response(writer, 413, {"error": "Corps de la requête trop volumineux."}, False)
+                    break
+                body = await reader.readexactly(content_length)
+
+                started = time.perf_counter()
+                try:
+                    status, payload = await self.dispatch(method, target, body)
+                except RequestError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except Exception as e:
+                    logging.exception(f"Erreur lors du traitement de {method} {target}")
+                    status, payload = 500, {"error": str(e)}
+                logging.info(f"{method} {target} {status} {(time.perf_counter() - started) * 1000:.1f} ms")
+
+                await write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            # Requête mal formée ou connexion interrompue par le client
+            pass
+        finally:
+            writer.close()
+
+    # Rafraîchit périodiquement les données en arrière-plan
+    async def refresh_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await loop.run_in_executor(self.refresh_executor, self.load_dataset, True)
+
+    async def serve(self, host, port):
+        loop = asyncio.get_running_loop()
+        # Le jeu de données est chargé avant d'accepter les connexions
+        if not await loop.run_in_executor(self.refresh_executor, self.load_dataset, not self.offline):
+            logging.error("Impossible de charger les données d'antennes.")
+            return 1
+
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logging.info(f"Serveur à l'écoute sur http://{host}:{port}")
+        refresh_task = None
+        if self.refresh_interval > 0 and not self.offline:
+            refresh_task = asyncio.create_task(self.refresh_periodically())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if refresh_task is not None:
+                refresh_task.cancel()
+            self.query_executor.shutdown(wait=False)
+            self.refresh_executor.shutdown(wait=False)
+        return 0
+
+
+# Fonction pour écrire une réponse HTTP au format JSON (ou texte brut pour les métriques)
+async def write_response(writer, status, payload, keep_alive):
+    if isinstance(payload, str):
+        body = payload.encode("utf-8")
+        content_type = "text/plain; version=0.0.4; charset=utf-8"
+    else:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        content_type = "application/json; charset=utf-8"
+    head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+
+# Fonction pour vérifier les opérateurs et les générations demandés
+def parse_selection(values, allowed, name):
+    if values is None:
+        return list(allowed)
+    unknown = [value for value in values if value not in allowed]
+    if unknown:
+        raise RequestError(400, f"Valeurs inconnues pour {name} : {', '.join(unknown)}")
+    return values
+
+# Fonction pour vérifier les points d'une requête, avec les mêmes règles que cli.py
+def parse_points(points):
+    missing_columns = {"latitude", "longitude", "radius"} - set(points.columns)
+    if missing_columns:
+        raise RequestError(400, f"Paramètres manquants : {', '.join(sorted(missing_columns))}")
+    validation_error = validate_points(points)
+    if validation_error is not None:
+        raise RequestError(400, validation_error)
+    # Un rayon nul donnerait une densité 0/0, qui n'a pas de représentation JSON
+    zero_radius_rows = np.flatnonzero(points["radius"].astype(float).values <= 0)
+    if len(zero_radius_rows):
+        raise RequestError(400, f"Le rayon doit être strictement positif. (lignes : {', '.join(str(row) for row in zero_radius_rows[:10])})")
+    return points
+
+# Fonction pour lire un point unique dans les paramètres de l'URL (GET /density?lat=..&lon=..&radius=..)
+def parse_query_string(query):
+    params = parse_qs(query)
+    try:
+        points = pd.DataFrame({"latitude": params["lat"][:1], "longitude": params["lon"][:1], "radius": params["radius"][:1]})
+    except KeyError as e:
+        raise RequestError(400, f"Paramètre manquant : {e.args[0]}")
+    operators = params["operators"][0].split(",") if "operators" in params else None
+    generations = params["generations"][0].split(",") if "generations" in params else None
+    approximate = params.get("approximate", ["0"])[0].lower() in ("1", "true", "yes")
+    return (parse_points(points), parse_selection(operators, OPERATORS, "operators"),
+            parse_selection(generations, GENERATIONS, "generations"), approximate)
+
+# Fonction pour lire une liste de points dans un corps JSON (POST /density)
+def parse_json_body(body):
+    try:
+        request = json.loads(body)
+        points = pd.DataFrame(request["points"], columns=["latitude", "longitude", "radius"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise RequestError(400, f"Corps de la requête invalide : {e}")
+    return (parse_points(points), parse_selection(request.get("operators"), OPERATORS, "operators"),
+            parse_selection(request.get("generations"), GENERATIONS, "generations"), bool(request.get("approximate", False)))
+
+# Fonction pour convertir le tableau de résultats en un objet par point, comme calculate_antenna_density_and_counts
+def format_results(result, n_points):
+    results = [{"densities": {}, "antenna_counts": {}, "oriented_antennas": {}} for _ in range(n_points)]
+    for point, generation, operator, density, count, oriented_count in zip(
+            result["point"], result["generation"], result["operator"], result["density"], result["count"], result["oriented_count"]):
+        results[point]["densities"].setdefault(generation, {})[operator] = float(density)
+        results[point]["antenna_counts"].setdefault(generation, {})[operator] = int(count)
+        results[point]["oriented_antennas"].setdefault(generation, {})[operator] = int(oriented_count)
+    return results
+
+# Fonction pour analyser les arguments de la ligne de commande
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="server.py",
+        description="Serveur HTTP/JSON de calcul de densité d'antennes, avec les données gardées en mémoire.",
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Adresse d'écoute")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port d'écoute")
+    parser.add_argument("--workers", type=int, default=DEFAULT_QUERY_WORKERS, help="Nombre de threads de calcul")
+    parser.add_argument("--refresh-interval", type=int, default=DEFAULT_REFRESH_INTERVAL,
+                        help="Intervalle en secondes entre deux rafraîchissements des données (0 pour les désactiver)")
+    parser.add_argument("--offline", action="store_true",
+                        help="Utilise les données locales sans vérifier leur fraîcheur en ligne")
+    parser.add_argument("--instrument", action="store_true",
+                        help="Mesure chaque requête par étape (journal et GET /metrics au format Prometheus)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    logging.basicConfig(filename='app.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    args = parse_args(argv)
+    if args.instrument:
+        instrumentation.enable()
+    query_server = QueryServer(args.workers, args.refresh_interval, args.offline)
+    try:
+        return asyncio.run(query_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
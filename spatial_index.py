@@ -0,0 +1,121 @@
+import math
+
+import numpy as np
+
+# Rayon de la Terre en kilomètres, identique à celui de celldatawizard.haversine
+EARTH_RADIUS_KM = 6371.0
+
+# Taille par défaut des cellules de la grille, en degrés (environ 5,5 km en latitude)
+DEFAULT_CELL_SIZE = 0.05
+
+# Marge ajoutée autour de la boîte englobante, en degrés (environ 10 cm), pour absorber les erreurs d'arrondi
+BOX_PADDING = 1e-6
+
+# Rayon initial (km) de la recherche des plus proches voisins, doublé tant que le cercle ne contient pas assez d'antennes
+DEFAULT_NEAREST_RADIUS = 2.0
+
+
+# Index spatial en grille latitude/longitude : les antennes sont triées par cellule,
+# et une requête de rayon ne parcourt que les cellules qui recoupent le cercle
+class GridIndex:
+    def __init__(self, latitudes, longitudes, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.n_lat_cells = int(math.ceil(180 / cell_size)) + 1
+        self.n_lon_cells = int(math.ceil(360 / cell_size)) + 1
+        self.size = len(latitudes)
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        keys = self._cell_keys(latitudes, longitudes)
+
+        # Tri stable des antennes par cellule : chaque cellule correspond à une tranche contiguë
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def _cell(self, offset_degrees):
+        return int(math.floor(offset_degrees / self.cell_size))
+
+    def _cell_keys(self, latitudes, longitudes):
+        lat_cells = np.floor((latitudes + 90) / self.cell_size)
+        lon_cells = np.floor((longitudes + 180) / self.cell_size)
+        keys = lat_cells * self.n_lon_cells + lon_cells
+        # Les coordonnées invalides ne sont jamais dans un rayon, elles reçoivent une clé jamais interrogée
+        keys = np.where(np.isfinite(keys), keys, -1)
+        return keys.astype(np.int64)
+
+    # Renvoie les positions (triées) des antennes susceptibles d'être à moins de radius km du point
+    def query_candidates(self, lat, lon, radius):
+        angular_radius = radius / EARTH_RADIUS_KM
+        lat_min = lat - math.degrees(angular_radius) - BOX_PADDING
+        lat_max = lat + math.degrees(angular_radius) + BOX_PADDING
+
+        # Près des pôles ou pour un très grand rayon, le cercle couvre toutes les longitudes
+        if lat_min <= -90 or lat_max >= 90 or angular_radius >= math.pi / 2:
+            return np.arange(self.size)
+
+        # Demi-largeur exacte en longitude d'une calotte sphérique
+        lon_half_width = math.degrees(math.asin(min(1.0, math.sin(angular_radius) / math.cos(math.radians(lat))))) + BOX_PADDING
+        lat_cell_min = self._cell(lat_min + 90)
+        lat_cell_max = self._cell(lat_max + 90)
+        lon_min = lon - lon_half_width
+        lon_max = lon + lon_half_width
+
+        # Plages de cellules en longitude, découpées en cas de passage par l'antiméridien
+        if lon_half_width >= 180:
+            lon_ranges = [(0, self.n_lon_cells - 1)]
+        elif lon_min < -180:
+            lon_ranges = [(0, self._cell(lon_max + 180)), (self._cell(lon_min + 360 + 180), self.n_lon_cells - 1)]
+        elif lon_max > 180:
+            lon_ranges = [(self._cell(lon_min + 180), self.n_lon_cells - 1), (0, self._cell(lon_max - 360 + 180))]
+        else:
+            lon_ranges = [(self._cell(lon_min + 180), self._cell(lon_max + 180))]
+
+        # Chaque ligne de la grille donne une plage contiguë de clés, résolue par recherche dichotomique
+        lat_cells = np.arange(max(lat_cell_min, 0), min(lat_cell_max, self.n_lat_cells - 1) + 1)
+        starts = []
+        ends = []
+        for lon_start, lon_end in lon_ranges:
+            starts.append(np.searchsorted(self.sorted_keys, lat_cells * self.n_lon_cells + lon_start, side="left"))
+            ends.append(np.searchsorted(self.sorted_keys, lat_cells * self.n_lon_cells + lon_end, side="right"))
+        starts = np.concatenate(starts)
+        ends = np.concatenate(ends)
+
+        slices = [self.order[start:end] for start, end in zip(starts, ends) if end > start]
+        if not slices:
+            return np.empty(0, dtype=np.intp)
+        # Le tri rétablit l'ordre d'origine des lignes, comme le filtre exhaustif
+        return np.sort(np.concatenate(slices))
+
+    # Renvoie les positions des k antennes les plus proches du point, triées par distance, et leurs distances en km.
+    # Le rayon de recherche double jusqu'à contenir k antennes : seules les cellules proches sont parcourues
+    def query_nearest(self, lat, lon, k, initial_radius=DEFAULT_NEAREST_RADIUS):
+        k = min(k, self.size)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+        radius = initial_radius
+        while True:
+            candidates = self.query_candidates(lat, lon, radius)
+            distances = haversine_distances(lat, lon, self.latitudes[candidates], self.longitudes[candidates])
+            # Les k plus proches sont dans le cercle dès qu'il en contient k ; sinon, toutes les antennes ont été mesurées
+            within = distances <= radius
+            complete = len(candidates) == self.size
+            if np.count_nonzero(within) >= k or complete:
+                if complete:
+                    within = np.isfinite(distances)
+                candidates = candidates[within]
+                distances = distances[within]
+                nearest = np.argsort(distances, kind="stable")[:k]
+                return candidates[nearest], distances[nearest]
+            radius *= 2
+
+
+# Fonction pour calculer les distances (en km) entre un point et des antennes, comme celldatawizard.haversine
+def haversine_distances(lat, lon, latitudes, longitudes):
+    lat, lon = math.radians(lat), math.radians(lon)
+    latitudes = np.radians(latitudes)
+    longitudes = np.radians(longitudes)
+    a = np.sin((latitudes - lat) / 2) ** 2 + math.cos(lat) * np.cos(latitudes) * np.sin((longitudes - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
@@ -0,0 +1,356 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import augmented_data
+import celldatawizard
+import data_update
+from data_update import stream_json_records
+from spatial_index import GridIndex
+
+# Points de requête : France, antiméridien, près des pôles, et points en dehors de toute antenne
+QUERY_POINTS = [(48.8566, 2.3522), (43.2965, 5.3698), (-17.5, 179.99), (65.0, -179.98), (89.95, 10.0), (-89.9, -45.0), (0.0, 0.0)]
+QUERY_RADII = [0.5, 5, 50, 500, 5000]
+
+
+# Antennes aléatoires : un semis dense sur la France et un semis clairsemé sur tout le globe
+def make_antennas(seed=0):
+    rng = np.random.default_rng(seed)
+    latitudes = np.concatenate([rng.uniform(42, 51, 20_000), rng.uniform(-90, 90, 5_000)])
+    longitudes = np.concatenate([rng.uniform(-5, 8, 20_000), rng.uniform(-180, 180, 5_000)])
+    return pd.DataFrame({"latitude": latitudes, "longitude": longitudes})
+
+
+# Filtre exhaustif : distance de toutes les antennes au point
+def brute_force_rows(df, lat, lon, radius):
+    return np.flatnonzero(celldatawizard.haversine(lat, lon, df["latitude"].values, df["longitude"].values) <= radius)
+
+
+@pytest.mark.parametrize("lat, lon", QUERY_POINTS)
+@pytest.mark.parametrize("radius", QUERY_RADII)
+def test_grid_candidates_contain_every_antenna_within_radius(lat, lon, radius):
+    df = make_antennas()
+    candidates = GridIndex(df["latitude"].values, df["longitude"].values).query_candidates(lat, lon, radius)
+    distances = celldatawizard.haversine(lat, lon, df["latitude"].values[candidates], df["longitude"].values[candidates])
+    np.testing.assert_array_equal(candidates[distances <= radius], brute_force_rows(df, lat, lon, radius))
+
+
+@pytest.mark.parametrize("lat, lon", QUERY_POINTS)
+def test_filter_antennas_by_radius_matches_full_scan(lat, lon):
+    df = make_antennas(seed=1)
+    for radius in QUERY_RADII:
+        expected = celldatawizard.filter_df_within_radius(celldatawizard.add_geometry_and_distance_to_df(df.copy(), lat, lon), radius)
+        pd.testing.assert_frame_equal(celldatawizard.filter_antennas_by_radius(df, lat, lon, radius), expected)
+
+
+def test_grid_nearest_matches_sorted_distances():
+    df = make_antennas(seed=2)
+    index = GridIndex(df["latitude"].values, df["longitude"].values)
+    for lat, lon in QUERY_POINTS:
+        distances = celldatawizard.haversine(lat, lon, df["latitude"].values, df["longitude"].values)
+        nearest, nearest_distances = index.query_nearest(lat, lon, 10)
+        np.testing.assert_allclose(nearest_distances, np.sort(distances)[:10])
+        np.testing.assert_allclose(distances[nearest], nearest_distances)
+
+
+# Enregistrements proches de l'export ANFR, avec des caractères multi-octets et des séparateurs JSON dans les chaînes
+STREAM_RECORDS = [{"id": i, "sta_nm_anfr": f"{i:07d}", "adm_lb_nom": "SFR", "emr_lb_systeme": "LTE 800",
+                   "adr_lb_lieu": ["Église Saint-Étienne", "Château d'eau ], {", "Gîte « Les Prés »"][i % 3],
+                   "coordonnees": [48.0 + i / 1000, -1.5 + i / 1000], "details": {"hauteur": None, "zones": [i, "€"]}}
+                  for i in range(60)]
+
+
+# Découpage aléatoire d'octets en blocs, jusqu'à des blocs d'un octet qui coupent les caractères UTF-8
+def split_randomly(data, rng, max_chunk_size):
+    chunks = []
+    position = 0
+    while position < len(data):
+        size = int(rng.integers(1, max_chunk_size + 1))
+        chunks.append(data[position:position + size])
+        position += size
+    return chunks
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_stream_json_records_with_random_chunks(seed):
+    rng = np.random.default_rng(seed)
+    data = json.dumps(STREAM_RECORDS, ensure_ascii=False, indent=None if seed % 2 else 2).encode("utf-8")
+    for max_chunk_size in (1, 7, 64, 4096):
+        assert list(stream_json_records(split_randomly(data, rng, max_chunk_size))) == STREAM_RECORDS
+
+
+@pytest.mark.parametrize("data", [b"[]", b"  [ ]  ", b"\n[\n]\n"])
+def test_stream_json_records_empty_array(data):
+    assert list(stream_json_records([data])) == []
+
+
+@pytest.mark.parametrize("data", [b'{"id": 1}', b'[{"id": 1}, {"id": 2}', b'[{"id": 1}, {"id": '])
+def test_stream_json_records_rejects_invalid_documents(data):
+    with pytest.raises(ValueError):
+        list(stream_json_records([data[:5], data[5:]]))
+
+
+# Magasin colonnaire de stations (id, sta_nm_anfr), chaque enregistrement ayant son empreinte
+def make_store(station_ids, station_numbers, record_hashes):
+    store = np.zeros(len(station_ids), dtype=data_update.STORE_DTYPE)
+    store["station_id"] = station_ids
+    store["sta_nm_anfr"] = station_numbers
+    store["record_hash"] = record_hashes
+    return store
+
+
+# Lignes d'un fichier augmenté dans un ordre canonique, champ par champ (les azimuts inconnus sont NaN)
+def sorted_augmented_fields(augmented):
+    augmented = np.sort(augmented, order=["station_id", "sta_nm_anfr", "aer_id"])
+    return {name: augmented[name] for name in augmented.dtype.names}
+
+
+# Table des antennes : de zéro à trois antennes par station, certaines sans azimut ; des stations en sont absentes
+def make_station_table(station_numbers, seed=0):
+    rng = np.random.default_rng(seed)
+    antenna_counts = rng.integers(0, 4, len(station_numbers))
+    return augmented_data.create_station_antenna_table(pd.DataFrame({
+        "STA_NM_ANFR": pd.Categorical(np.repeat(station_numbers, antenna_counts)),
+        "AER_ID": np.arange(antenna_counts.sum(), dtype=np.int32),
+        "AER_NB_AZIMUT": np.where(rng.random(antenna_counts.sum()) < 0.1, np.nan, rng.uniform(0, 360, antenna_counts.sum())).astype(np.float32),
+        "AER_NB_ALT_BAS": rng.uniform(0, 60, antenna_counts.sum()).astype(np.float32),
+    }))
+
+
+# Répertoires des magasins et des fichiers augmentés redirigés vers un répertoire temporaire
+@pytest.fixture
+def data_dirs(tmp_path, monkeypatch):
+    json_dir = tmp_path / "local_antenna_data"
+    augmented_dir = tmp_path / "local_antenna_data_augmented"
+    json_dir.mkdir()
+    augmented_dir.mkdir()
+    monkeypatch.setattr(augmented_data, "JSON_DIR", str(json_dir))
+    monkeypatch.setattr(augmented_data, "AUGMENTED_DATA_DIR", str(augmented_dir))
+    monkeypatch.setattr(augmented_data, "_azimuth_index", {})
+    return json_dir, augmented_dir
+
+
+def test_apply_pending_delta_matches_full_join(data_dirs):
+    json_dir, _ = data_dirs
+    station_numbers = [f"{number:07d}" for number in range(400)]
+    table = make_station_table(station_numbers)
+
+    # Ancienne version : 300 stations. Nouvelle version : 30 supprimées, 30 modifiées (dont 10 changent de sta_nm_anfr),
+    # 20 ajoutées (dont certaines absentes de la table)
+    previous_store = make_store(np.arange(300), station_numbers[:300], np.arange(300))
+    store = make_store(np.arange(30, 320), station_numbers[30:300] + [f"{number:07d}" for number in range(390, 410)], np.arange(30, 320))
+    store["record_hash"][:30] += 1000
+    store["sta_nm_anfr"][:10] = station_numbers[300:310]
+
+    filename = f"SFR_4G{data_update.STORE_EXT}"
+    augmented_data.write_augmented_file(augmented_data.get_augmented_filepath(filename),
+                                        augmented_data.join_stations_with_antennas(previous_store, table))
+    data_update.write_antenna_store("SFR", "4G", store, str(json_dir))
+    data_update.record_antenna_delta("SFR", "4G", data_update.diff_antenna_stores(previous_store, store), str(json_dir))
+    assert augmented_data.has_pending_delta(filename)
+
+    assert augmented_data.apply_pending_delta(filename, table)
+    updated = np.load(augmented_data.get_augmented_filepath(filename))
+    expected = augmented_data.join_stations_with_antennas(store, table)
+    assert len(updated) == len(expected)
+    for name, values in sorted_augmented_fields(expected).items():
+        np.testing.assert_array_equal(sorted_augmented_fields(updated)[name], values)
+    assert not augmented_data.has_pending_delta(filename)
+
+
+# Réponse HTTP 200 simulée, servant un export JSON par blocs
+class FakeResponse:
+    def __init__(self, body):
+        self.status_code = 200
+        self.headers = {"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for position in range(0, len(self.body), chunk_size):
+            yield self.body[position:position + chunk_size]
+
+
+def test_download_replaces_truncated_store_and_rebuilds_augmented_file(data_dirs, tmp_path, monkeypatch):
+    json_dir, augmented_dir = data_dirs
+    monkeypatch.setattr(data_update.http_client, "HTTP_CACHE_DIR", str(tmp_path / "http_cache"))
+    station_numbers = [f"{number:07d}" for number in range(100)]
+    table = make_station_table(station_numbers)
+    station_table_path = tmp_path / "SUP_ANTENNE.npz"
+    station_table_path.write_bytes(b"")
+    os.utime(station_table_path, (0, 0))
+    monkeypatch.setattr(augmented_data, "STATION_TABLE_FILENAME", str(station_table_path))
+
+    # Magasin et fichier augmenté cohérents, puis magasin tronqué (copie interrompue)
+    filename = f"SFR_4G{data_update.STORE_EXT}"
+    previous_store = make_store(np.arange(50), station_numbers[:50], np.arange(50))
+    data_update.write_antenna_store("SFR", "4G", previous_store, str(json_dir))
+    augmented_filepath = augmented_data.get_augmented_filepath(filename)
+    augmented_data.write_augmented_file(augmented_filepath, augmented_data.join_stations_with_antennas(previous_store, table))
+    augmented_data.record_augmented_files([filename])
+    assert not augmented_data.is_augmented_file_outdated(filename)
+    store_filepath = data_update.get_antenna_store_filepath("SFR", "4G", str(json_dir))
+    with open(store_filepath, "r+b") as f:
+        f.truncate(os.path.getsize(store_filepath) // 2)
+
+    # Le nouvel export est téléchargé malgré l'ancien magasin illisible
+    records = [{"fields": {"id": station_id, "sta_nm_anfr": station_numbers[station_id], "coordonnees": [2.0, 48.0]}}
+               for station_id in range(20, 100)]
+    body = json.dumps(records).encode("utf-8")
+    monkeypatch.setattr(data_update.http_client, "get", lambda url, **kwargs: FakeResponse(body))
+    assert data_update.download_antenna_data("SFR", "4G", str(json_dir))
+    store = data_update.read_antenna_data("SFR", "4G", str(json_dir))
+    np.testing.assert_array_equal(store["station_id"], np.arange(20, 100))
+
+    # Sans ancienne version à comparer, le fichier augmenté est entièrement reconstruit
+    assert augmented_data.is_augmented_file_outdated(filename)
+    assert augmented_data.merge_json_with_dataframe_and_save(filename, table)
+    expected = augmented_data.join_stations_with_antennas(store, table)
+    updated = np.load(augmented_filepath)
+    assert len(updated) == len(expected)
+    for name, values in sorted_augmented_fields(expected).items():
+        np.testing.assert_array_equal(sorted_augmented_fields(updated)[name], values)
+    assert not augmented_data.has_pending_delta(filename)
+
+
+# Jeu d'antennes de tous les groupes autour d'un point, avec de zéro à trois azimuts par station
+def make_oriented_antennas(seed=0, n_antennas=5_000):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "latitude": rng.uniform(45.5, 46.5, n_antennas),
+        "longitude": rng.uniform(2.5, 3.5, n_antennas),
+        "station_id": np.arange(n_antennas, dtype=np.int64),
+        "operator": rng.choice(celldatawizard.OPERATORS, n_antennas),
+        "generation": rng.choice(celldatawizard.GENERATIONS, n_antennas),
+    })
+    azimuth_indexes = {(operator, generation): {} for operator in celldatawizard.OPERATORS for generation in celldatawizard.GENERATIONS}
+    for station_id, operator, generation in zip(df["station_id"], df["operator"], df["generation"]):
+        azimuth_indexes[(operator, generation)][station_id] = rng.uniform(0, 360, rng.integers(0, 4)).tolist()
+    return df, azimuth_indexes
+
+
+@pytest.fixture
+def oriented_antennas(monkeypatch):
+    df, azimuth_indexes = make_oriented_antennas()
+    monkeypatch.setattr(augmented_data, "get_azimuth_index", lambda operator, generation: azimuth_indexes[(operator, generation)])
+    return df
+
+
+# Copies du jeu d'antennes dont l'index n'est plus la position des lignes
+def relabelled_frames(df):
+    yield "mélangé", df.sample(frac=1, random_state=0)
+    yield "étiquettes décalées", df.set_axis(df.index + 10_000)
+    yield "étiquettes texte", df.set_axis([f"antenne {row}" for row in range(len(df))])
+
+
+def test_single_point_results_do_not_depend_on_frame_index(oriented_antennas):
+    expected = celldatawizard.calculate_antenna_density_and_counts(celldatawizard.OPERATORS, celldatawizard.GENERATIONS,
+                                                                   oriented_antennas, 46.0, 3.0, 20)
+    assert sum(sum(counts.values()) for counts in expected[2].values()) > 0
+    for name, df in relabelled_frames(oriented_antennas):
+        assert celldatawizard.calculate_antenna_density_and_counts(celldatawizard.OPERATORS, celldatawizard.GENERATIONS,
+                                                                   df, 46.0, 3.0, 20) == expected, name
+
+    # Un sous-ensemble filtré (index à trous) donne le même résultat que sa copie réindexée
+    df = oriented_antennas[oriented_antennas["operator"] != "SFR"]
+    assert (celldatawizard.calculate_antenna_density_and_counts(["ORANGE", "FREE MOBILE"], ["4G", "5G"], df, 46.0, 3.0, 20)
+            == celldatawizard.calculate_antenna_density_and_counts(["ORANGE", "FREE MOBILE"], ["4G", "5G"], df.reset_index(drop=True), 46.0, 3.0, 20))
+
+
+def test_profile_results_do_not_depend_on_frame_index(oriented_antennas):
+    radii = [2, 5, 10, 20]
+    expected = celldatawizard.calculate_antenna_density_and_counts_multi_radius(celldatawizard.OPERATORS, celldatawizard.GENERATIONS,
+                                                                                oriented_antennas, 46.0, 3.0, radii)
+    # Le disque le plus grand du profil est le résultat du calcul en un point
+    assert expected[0][20.0] == celldatawizard.calculate_antenna_density_and_counts(celldatawizard.OPERATORS, celldatawizard.GENERATIONS,
+                                                                                    oriented_antennas, 46.0, 3.0, 20)
+    for name, df in relabelled_frames(oriented_antennas):
+        assert celldatawizard.calculate_antenna_density_and_counts_multi_radius(celldatawizard.OPERATORS, celldatawizard.GENERATIONS,
+                                                                                df, 46.0, 3.0, radii) == expected, name
+
+
+def test_join_gives_each_antenna_its_own_azimuth():
+    # Antennes d'une même station non contiguës dans SUP_ANTENNE, station C absente de la table
+    table = augmented_data.create_station_antenna_table(pd.DataFrame({
+        "STA_NM_ANFR": pd.Categorical(["A", "B", "A", "A"]),
+        "AER_ID": np.array([11, 21, 12, 13], dtype=np.int32),
+        "AER_NB_AZIMUT": np.array([10, 45, 120, 240], dtype=np.float32),
+        "AER_NB_ALT_BAS": np.array([30, 25, 32, 34], dtype=np.float32),
+    }))
+    # La station A apparaît deux fois dans le magasin (deux enregistrements ANFR)
+    store = make_store([1, 2, 3, 4], ["A", "C", "B", "A"], [0, 0, 0, 0])
+
+    augmented = augmented_data.join_stations_with_antennas(store, table)
+    assert augmented["station_id"].tolist() == [1, 1, 1, 3, 4, 4, 4]
+    assert augmented["sta_nm_anfr"].tolist() == ["A", "A", "A", "B", "A", "A", "A"]
+    assert augmented["aer_id"].tolist() == [11, 12, 13, 21, 11, 12, 13]
+    assert augmented["azimuth"].tolist() == [10, 120, 240, 45, 10, 120, 240]
+    assert augmented["altitude"].tolist() == [30, 32, 34, 25, 30, 32, 34]
+    # Chaque station garde tous les azimuts de ses antennes dans l'index
+    assert augmented_data.build_azimuth_index(augmented) == {1: [10, 120, 240], 3: [45], 4: [10, 120, 240]}
+
+
+# Antennes de la métropole et d'une île (deux régions de la grille de densité), sans orientations
+@pytest.fixture(scope="module")
+def regional_antennas():
+    rng = np.random.default_rng(3)
+    n_mainland, n_island = 40_000, 4_000
+    n_antennas = n_mainland + n_island
+    return pd.DataFrame({
+        "latitude": np.concatenate([rng.uniform(42.5, 51, n_mainland), rng.uniform(-21.4, -20.9, n_island)]),
+        "longitude": np.concatenate([rng.uniform(-4.5, 8, n_mainland), rng.uniform(55.2, 55.8, n_island)]),
+        "station_id": np.arange(n_antennas, dtype=np.int64),
+        "operator": rng.choice(celldatawizard.OPERATORS[:4], n_antennas),
+        "generation": rng.choice(celldatawizard.GENERATIONS, n_antennas),
+    })
+
+
+# Centre de la métropole, bords de la métropole, île et son bord, point en mer dont le cercle n'atteint qu'une partie des antennes
+@pytest.mark.parametrize("lat, lon", [(46.5, 2.5), (42.6, -4.4), (50.9, 7.9), (-21.1, 55.5), (-21.4, 55.8), (44.0, 9.0)])
+@pytest.mark.parametrize("radius", [20, 50, 100, 200])
+def test_density_grid_bounds_contain_exact_counts(regional_antennas, monkeypatch, lat, lon, radius):
+    monkeypatch.setattr(augmented_data, "get_azimuth_index", lambda operator, generation: {})
+    assert celldatawizard.get_density_grid(regional_antennas).query(lat, lon, radius) is not None
+    _, exact_counts, _ = celldatawizard.calculate_antenna_density_and_counts(celldatawizard.OPERATORS, celldatawizard.GENERATIONS,
+                                                                             regional_antennas, lat, lon, radius)
+    _, _, count_bounds = celldatawizard.calculate_antenna_density_and_counts_approximate(celldatawizard.OPERATORS, celldatawizard.GENERATIONS,
+                                                                                         regional_antennas, lat, lon, radius)
+    for generation in celldatawizard.GENERATIONS:
+        for operator in celldatawizard.OPERATORS:
+            lower, upper = count_bounds[generation][operator]
+            assert lower <= exact_counts[generation][operator] <= upper, (generation, operator)
+
+
+# max_pairs de 1 : un bloc par point ; 500 : blocs de quelques points, coupés au milieu de la liste ; sans limite : un seul bloc
+@pytest.mark.parametrize("max_pairs", [1, 500, 10 ** 9])
+def test_batch_matches_single_point_results(oriented_antennas, max_pairs):
+    rng = np.random.default_rng(4)
+    n_points = 40
+    # Points dans le semis, sur ses bords et en dehors (aucune antenne), rayons de 500 m à 30 km
+    lats = np.concatenate([rng.uniform(45.4, 46.6, n_points - 2), [46.0, 40.0]])
+    lons = np.concatenate([rng.uniform(2.4, 3.6, n_points - 2), [3.0, 10.0]])
+    radii = np.concatenate([rng.uniform(0.5, 30, n_points - 2), [15.0, 5.0]])
+    operators = ["SFR", "ORANGE", "FREE MOBILE"]
+    generations = ["5G", "4G", "2G"]
+
+    result = celldatawizard.calculate_antenna_density_and_counts_batch(operators, generations, oriented_antennas, lats, lons, radii,
+                                                                       max_pairs=max_pairs)
+    assert len(result) == n_points * len(operators) * len(generations)
+    for point, rows in result.groupby("point"):
+        densities, antenna_counts, oriented = celldatawizard.calculate_antenna_density_and_counts(
+            operators, generations, oriented_antennas, lats[point], lons[point], radii[point])
+        for row in rows.itertuples():
+            assert row.count == antenna_counts[row.generation][row.operator], (point, row.generation, row.operator)
+            assert row.oriented_count == oriented[row.generation].get(row.operator, 0), (point, row.generation, row.operator)
+            assert row.density == pytest.approx(densities[row.generation][row.operator])
@@ -0,0 +1,82 @@
+import http.server
+import json
+import os
+import threading
+
+import pytest
+
+import http_client
+
+
+# Serveur HTTP local servant une ressource avec ETag et Last-Modified, et répondant 304 aux requêtes conditionnelles à jour
+class CachedResourceHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        resource = self.server.resource
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == resource["etag"]:
+            self.send_response(304)
+            self.send_header("ETag", resource["etag"])
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", resource["etag"])
+        self.send_header("Last-Modified", resource["last_modified"])
+        self.send_header("Content-Length", str(len(resource["body"])))
+        self.end_headers()
+        self.wfile.write(resource["body"])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def resource_server(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_client, "HTTP_CACHE_DIR", str(tmp_path / "http_cache"))
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), CachedResourceHandler)
+    server.resource = {"etag": '"v1"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT", "body": b"STA_NM_ANFR;AER_ID\n" * 1000}
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_cached_revalidates_with_local_server(resource_server, tmp_path):
+    url = f"http://127.0.0.1:{resource_server.server_address[1]}/SUP_ANTENNE.zip"
+    local_path = str(tmp_path / "downloads" / "SUP_ANTENNE.zip")
+
+    # Premier téléchargement : réponse 200, fichier et entrée d'index écrits
+    assert http_client.fetch_cached(url, local_path)
+    assert "If-None-Match" not in resource_server.requests[-1]
+    with open(local_path, "rb") as f:
+        assert f.read() == resource_server.resource["body"]
+    with open(http_client.get_cache_index_path(), "r") as f:
+        entry = json.load(f)[os.path.abspath(local_path)]
+    assert entry == {"url": url, "etag": '"v1"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT",
+                     "size": len(resource_server.resource["body"])}
+
+    # Deuxième téléchargement : requête conditionnelle, réponse 304, fichier conservé tel quel
+    mtime_ns = os.stat(local_path).st_mtime_ns
+    assert not http_client.fetch_cached(url, local_path)
+    assert resource_server.requests[-1]["If-None-Match"] == '"v1"'
+    assert resource_server.requests[-1]["If-Modified-Since"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert os.stat(local_path).st_mtime_ns == mtime_ns
+
+    # Copie locale modifiée (taille différente) : les en-têtes conditionnels sont abandonnés et la ressource est retéléchargée
+    with open(local_path, "ab") as f:
+        f.write(b"copie locale modifiee")
+    assert http_client.fetch_cached(url, local_path)
+    assert "If-None-Match" not in resource_server.requests[-1]
+    assert "If-Modified-Since" not in resource_server.requests[-1]
+    with open(local_path, "rb") as f:
+        assert f.read() == resource_server.resource["body"]
+
+    # Nouvelle version sur le serveur : l'ancien ETag ne correspond plus, la ressource est remplacée
+    resource_server.resource = {"etag": '"v2"', "last_modified": "Tue, 02 Jan 2024 00:00:00 GMT", "body": b"nouvelle version\n"}
+    assert http_client.fetch_cached(url, local_path)
+    assert resource_server.requests[-1]["If-None-Match"] == '"v1"'
+    with open(local_path, "rb") as f:
+        assert f.read() == b"nouvelle version\n"
+    assert len(resource_server.requests) == 4
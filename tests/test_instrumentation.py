@@ -0,0 +1,38 @@
+import threading
+import time
+
+import pytest
+
+import celldatawizard
+import instrumentation
+
+
+@pytest.fixture
+def instrumentation_enabled():
+    instrumentation.enable()
+    yield
+    instrumentation.disable()
+    instrumentation.clear()
+
+
+def test_run_antenna_jobs_keeps_every_result_when_instrumented(instrumentation_enabled):
+    # Les jobs attendent d'avoir tous démarré : ils s'exécutent forcément en même temps dans les threads
+    operators = ["ORANGE", "SFR", "FREE MOBILE"]
+    generations = ["2G", "3G", "4G", "5G"]
+    all_started = threading.Barrier(len(operators) * len(generations), timeout=10)
+
+    def job(operator, generation, local_data_dir):
+        all_started.wait()
+        with instrumentation.stage("job"):
+            time.sleep(0.01)
+        instrumentation.count("jobs_done")
+        return f"{operator}_{generation}"
+
+    with instrumentation.request("run_antenna_jobs") as record:
+        results = celldatawizard.run_antenna_jobs(job, operators, generations, "unused", (), None,
+                                                  max_workers=len(operators) * len(generations))
+
+    assert results == {(operator, generation): f"{operator}_{generation}" for operator in operators for generation in generations}
+    # Les mesures des threads sont bien rattachées à la requête
+    assert record.stages["job"]["calls"] == len(results)
+    assert record.counters["jobs_done"] == len(results)
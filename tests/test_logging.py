@@ -0,0 +1,51 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+import augmented_data
+import data_update
+
+
+def test_augmentation_workers_keep_parent_log_file(tmp_path, monkeypatch):
+    # Les répertoires relatifs par défaut sont ceux du répertoire courant, que les processus de travail reprennent
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(augmented_data, "_azimuth_index", {})
+    log_handler = logging.FileHandler("app.log", mode="w")
+    logging.getLogger().addHandler(log_handler)
+    try:
+        parent_lines = [f"Ligne {number} du processus parent" for number in range(200)]
+        for line in parent_lines:
+            logging.getLogger().warning(line)
+        log_handler.flush()
+
+        # Deux magasins à augmenter : le pool démarre au moins un processus de travail
+        station_numbers = [f"{number:07d}" for number in range(10)]
+        augmented_data.save_station_antenna_table(augmented_data.STATION_TABLE_FILENAME, augmented_data.create_station_antenna_table(pd.DataFrame({
+            "STA_NM_ANFR": pd.Categorical(station_numbers),
+            "AER_ID": np.arange(10, dtype=np.int32),
+            "AER_NB_AZIMUT": np.linspace(0, 350, 10, dtype=np.float32),
+            "AER_NB_ALT_BAS": np.full(10, 30, dtype=np.float32),
+        })))
+        (tmp_path / augmented_data.JSON_DIR).mkdir()
+        (tmp_path / augmented_data.AUGMENTED_DATA_DIR).mkdir()
+        for generation in ("4G", "5G"):
+            store = np.zeros(10, dtype=data_update.STORE_DTYPE)
+            store["station_id"] = np.arange(10)
+            store["sta_nm_anfr"] = station_numbers
+            data_update.write_antenna_store("SFR", generation, store, augmented_data.JSON_DIR)
+
+        augmented_data.process_json_files(use_processes=True)
+        logging.getLogger().warning("Fin du traitement")
+        log_handler.flush()
+    finally:
+        logging.getLogger().removeHandler(log_handler)
+        log_handler.close()
+
+    # Les fichiers ont été augmentés et le journal du parent est intact
+    for generation in ("4G", "5G"):
+        assert len(np.load(augmented_data.get_augmented_filepath(f"SFR_{generation}{data_update.STORE_EXT}"))) == 10
+    log_text = (tmp_path / "app.log").read_text(encoding="utf-8")
+    assert "\0" not in log_text
+    assert log_text.splitlines()[:len(parent_lines)] == parent_lines
+    assert log_text.splitlines()[-1] == "Fin du traitement"